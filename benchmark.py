@@ -0,0 +1,341 @@
+# 動画比較ビューアのベンチマーク
+# 合成した動画でデコード・表示・保存の速度を測り、結果をJSONで保存してベースラインと比較する
+#
+#   python benchmark.py -o result.json                      # 計測して保存
+#   python benchmark.py --baseline baseline.json            # ベースラインと比較
+#   python benchmark.py --baseline baseline.json --update-baseline  # ベースラインを更新
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import video_comparison_viewer as viewer
+
+# 合成動画の種類（名前, fourcc, 拡張子, 解像度, fps, GOP長（Noneはコーデック任せ））
+CLIP_SPECS = [
+    ("mp4v_360p_30fps_gop12", "mp4v", ".mp4", (640, 360), 30, 12),
+    ("mp4v_720p_30fps_gop250", "mp4v", ".mp4", (1280, 720), 30, 250),
+    ("mp4v_1080p_60fps_gop60", "mp4v", ".mp4", (1920, 1080), 60, 60),
+    ("mjpg_720p_24fps_intra", "MJPG", ".avi", (1280, 720), 24, None),
+]
+QUICK_CLIPS = ["mp4v_360p_30fps_gop12", "mjpg_720p_24fps_intra"]
+EXPORT_LAYOUTS = ["1x1", "1x2", "2x2", "2x3", "3x3"]
+QUICK_LAYOUTS = ["1x1", "2x2", "3x3"]
+# この割合より悪化した項目を退行として報告する
+DEFAULT_THRESHOLD = 0.10
+# 各計測の繰り返し回数（最初に1回捨てる分を別に実行し、中央値を結果にする）
+DEFAULT_REPEATS = 5
+# 小さな値は揺らぎだけで変化率が大きくなるので、この絶対差より小さい悪化は退行としない（単位ごと）
+MIN_ABSOLUTE_CHANGE = {'_s': 0.01, '_ms': 0.5}
+
+def synth_frame(frame_number, width, height):
+    # 動きのあるグラデーションと移動する矩形（フレームごとに内容が変わるようにする）
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:, :, 0] = (x + frame_number * 3) % 256
+    frame[:, :, 1] = (y + frame_number * 2) % 256
+    frame[:, :, 2] = ((x // 4 + y // 4 + frame_number) % 256)
+    size = max(8, height // 6)
+    left = (frame_number * 7) % max(1, width - size)
+    top = (frame_number * 5) % max(1, height - size)
+    frame[top:top + size, left:left + size] = 255
+    return frame
+
+def make_clip(path, fourcc, size, fps, gop, frame_count):
+    params = []
+    if gop is not None:
+        params = [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, gop]
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*fourcc), fps, size, params)
+    if not writer.isOpened():
+        # GOP長を指定できないバックエンドでは既定の設定で作る
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"テスト動画を作成できません: {path}")
+    width, height = size
+    for frame_number in range(frame_count):
+        writer.write(synth_frame(frame_number, width, height))
+    writer.release()
+
+def prepare_clips(workdir, names, frame_count):
+    # 同じ設定の動画が既にあれば作り直さない
+    clips = {}
+    for name, fourcc, ext, size, fps, gop in CLIP_SPECS:
+        if name not in names:
+            continue
+        path = os.path.join(workdir, f"{name}_{frame_count}{ext}")
+        if not os.path.exists(path):
+            print(f"テスト動画を作成中: {os.path.basename(path)}")
+            make_clip(path, fourcc, size, fps, gop, frame_count)
+        clips[name] = path
+    return clips
+
+def summarize_ms(samples):
+    samples_ms = np.array(samples) * 1000
+    return {
+        'mean_ms': float(samples_ms.mean()),
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+    }
+
+def repeat_median(measure, repeats):
+    # ウォームアップ（ファイルキャッシュやデコーダの初期化）の1回を捨て、repeats回の中央値を返す
+    # measureは {項目: 値} を返す関数
+    measure()
+    runs = [measure() for _ in range(max(1, repeats))]
+    return {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+
+def bench_decode(path, display_size, seek_count, seed=0, repeats=DEFAULT_REPEATS):
+    return repeat_median(lambda: measure_decode(path, display_size, seek_count, seed), repeats)
+
+def measure_decode(path, display_size, seek_count, seed=0):
+    results = {}
+
+    # 連続読み込み（再生時と同じ経路）
+    player = viewer.VideoPlayer(path, (0, 0), display_size)
+    samples = []
+    for frame_number in range(player.frame_count):
+        t0 = time.perf_counter()
+        player.get_frame(frame_number)
+        samples.append(time.perf_counter() - t0)
+    player.release()
+    for key, value in summarize_ms(samples).items():
+        results[f'sequential_{key}'] = value
+    results['sequential_fps'] = len(samples) / sum(samples)
+
+    # ランダムシーク（スクラブ時と同じ経路。インデックスありとなしの両方）
+    index = viewer.VideoIndex.build(path)
+    positions = random.Random(seed).sample(range(player.frame_count), min(seek_count, player.frame_count))
+    for label, seek_index in (("random", None), ("random_indexed", index)):
+        player = viewer.VideoPlayer(path, (0, 0), display_size, index=seek_index)
+        samples = []
+        for frame_number in positions:
+            t0 = time.perf_counter()
+            player.get_frame(frame_number)
+            samples.append(time.perf_counter() - t0)
+        player.release()
+        for key, value in summarize_ms(samples).items():
+            results[f'{label}_{key}'] = value
+    return results
+
+def bench_export(clip_paths, layouts, canvas_size, frame_count, encoder, workdir, repeats=DEFAULT_REPEATS):
+    # 保存処理全体（_save_video_processと同じrender_comparisonの経路）のスループット
+    results = {}
+    backends = {}
+    frame_indices = viewer.export_frame_indices(frame_count, 1.0)
+    for layout in layouts:
+        rows, cols = viewer.parse_layout(layout)
+        inputs = [clip_paths[i % len(clip_paths)] for i in range(rows * cols)]
+        tile_layout = viewer.compute_tile_layout(layout, canvas_size, len(inputs))
+        tiles = [(path, position, size) for path, (position, size) in zip(inputs, tile_layout)]
+        output_path = os.path.join(workdir, f"export_{layout}.mp4")
+        
+        def measure():
+            t0 = time.perf_counter()
+            stats_list = viewer.render_comparison(tiles, canvas_size, frame_indices, output_path, 30, 1,
+                                                  encoder=encoder)
+            elapsed = time.perf_counter() - t0
+            stats = stats_list[0]
+            backends[layout] = stats.get('backend', '?')
+            os.remove(output_path)
+            return {'fps': len(frame_indices) / elapsed, 'decode_s': sum(stats['decode_s']),
+                    'compose_s': stats['compose_s'], 'write_s': stats['write_s']}
+        
+        for key, value in repeat_median(measure, repeats).items():
+            results[f'{layout}.{key}'] = value
+    return results, backends
+
+def bench_gui(clip_paths, layouts, frame_count, repeats=DEFAULT_REPEATS):
+    # 表示の計測にはディスプレイが必要（なければスキップ）
+    try:
+        root = viewer.tkinterdnd2.TkinterDnD.Tk()
+    except Exception as e:
+        return None, f"ディスプレイがないためスキップ: {e}"
+
+    results = {}
+    try:
+        app = viewer.VideoComparisonApp(root)
+        root.geometry("1280x720")
+        root.update()
+        app.drop_label.place_forget()
+        app.videos = [clip_paths[i % len(clip_paths)] for i in range(9)]
+
+        # レイアウト変更（初回はデコーダを開く分も含む）
+        for layout in layouts:
+            app.layout_var.set(layout)
+            t0 = time.perf_counter()
+            app.update_layout()
+            root.update()
+            results[f'update_layout.{layout}_ms'] = (time.perf_counter() - t0) * 1000
+
+        # フレーム表示（合成からキャンバスへの描画まで）
+        app.layout_var.set("2x2")
+        app.update_layout()
+        root.update()
+        frames = min(frame_count, app.max_frames)
+
+        def measure_display(force):
+            # force=Falseでは毎回デコードさせるためにキャッシュを空にする
+            # force=Trueはキャッシュ済みのフレームを表示し直す場合（合成と描画のみ）
+            if not force:
+                app.frame_cache.clear()
+            app.tile_frames = []
+            t0 = time.perf_counter()
+            for frame_number in range(frames):
+                app.current_frame = frame_number
+                app.update_frame_display(force=force)
+                root.update()
+            return {'fps': frames / (time.perf_counter() - t0)}
+
+        results['update_frame_display.2x2_fps'] = repeat_median(lambda: measure_display(False), repeats)['fps']
+        results['update_frame_display.2x2_cached_fps'] = repeat_median(lambda: measure_display(True), repeats)['fps']
+
+        for player in app.player_pool.values():
+            player.release()
+    finally:
+        root.destroy()
+    return results, None
+
+def higher_is_better(metric):
+    return metric.endswith('fps')
+
+def min_absolute_change(metric):
+    for suffix, value in MIN_ABSOLUTE_CHANGE.items():
+        if metric.endswith(suffix):
+            return value
+    return 0.0
+
+def compare_with_baseline(metrics, baseline_metrics, threshold):
+    # 共通の項目について変化率を求め、しきい値を超えて悪化したものを退行とする
+    # （時間の項目は絶対差がMIN_ABSOLUTE_CHANGEに満たなければ揺らぎとみなす）
+    comparison = {}
+    for metric, value in metrics.items():
+        base = baseline_metrics.get(metric)
+        if not base:
+            continue
+        change = (value - base) / base
+        if higher_is_better(metric):
+            regressed = change < -threshold
+        else:
+            regressed = change > threshold and value - base >= min_absolute_change(metric)
+        comparison[metric] = {'baseline': base, 'current': value, 'change': change, 'regressed': regressed}
+    return comparison
+
+def print_comparison(comparison):
+    print(f"{'項目':<60} {'ベースライン':>12} {'今回':>12} {'変化':>8}")
+    for metric, row in sorted(comparison.items()):
+        mark = " ← 退行" if row['regressed'] else ""
+        print(f"{metric:<60} {row['baseline']:>12.2f} {row['current']:>12.2f} {row['change'] * 100:>+7.1f}%{mark}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動画比較ビューアのベンチマーク")
+    parser.add_argument('-o', '--output', default="benchmark_result.json", help="結果を書き出すJSONファイル")
+    parser.add_argument('--baseline', help="比較するベースラインのJSONファイル")
+    parser.add_argument('--update-baseline', action='store_true', help="結果でベースラインを上書きする")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="退行とみなす悪化の割合")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help="各計測の繰り返し回数（ウォームアップの1回を除いた中央値を使う）")
+    parser.add_argument('--quick', action='store_true', help="動画とレイアウトを減らして短時間で計測する")
+    parser.add_argument('--frames', type=int, default=None, help="テスト動画のフレーム数")
+    parser.add_argument('--seeks', type=int, default=40, help="ランダムシークの回数")
+    parser.add_argument('--size', default="1280x720", help="保存する比較動画の解像度")
+    parser.add_argument('--encoder', choices=["auto", "ffmpeg", "opencv"], default="auto", help="保存に使うエンコーダ")
+    parser.add_argument('--workdir', default=viewer.get_cache_dir("benchmark"), help="テスト動画の保存先")
+    parser.add_argument('--skip', nargs='*', default=[], choices=["decode", "export", "gui"], help="計測しない項目")
+    args = parser.parse_args(argv)
+
+    frame_count = args.frames or (90 if args.quick else 240)
+    clip_names = QUICK_CLIPS if args.quick else [spec[0] for spec in CLIP_SPECS]
+    layouts = QUICK_LAYOUTS if args.quick else EXPORT_LAYOUTS
+    canvas_size = viewer.parse_size(args.size)
+    encoder = dict(viewer.DEFAULT_ENCODER_SETTINGS, backend=args.encoder)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    clips = prepare_clips(args.workdir, clip_names, frame_count)
+
+    metrics = {}
+    skipped = {}
+    export_backends = {}
+
+    if "decode" not in args.skip:
+        for name, path in clips.items():
+            print(f"デコード計測: {name}")
+            for key, value in bench_decode(path, (640, 360), args.seeks, repeats=args.repeats).items():
+                metrics[f'decode.{name}.{key}'] = value
+
+    if "export" not in args.skip:
+        print(f"保存計測: {', '.join(layouts)}")
+        with tempfile.TemporaryDirectory() as workdir:
+            export_metrics, export_backends = bench_export(list(clips.values()), layouts, canvas_size,
+                                                           frame_count, encoder, workdir, args.repeats)
+        for key, value in export_metrics.items():
+            metrics[f'export.{key}'] = value
+
+    if "gui" not in args.skip:
+        print("表示計測")
+        gui_metrics, reason = bench_gui(list(clips.values()), layouts, frame_count, args.repeats)
+        if gui_metrics is None:
+            print(reason)
+            skipped['gui'] = reason
+        else:
+            for key, value in gui_metrics.items():
+                metrics[f'gui.{key}'] = value
+
+    result = {
+        'version': 1,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'frames': frame_count,
+            'clips': clip_names,
+            'layouts': layouts,
+            'export_size': list(canvas_size),
+            'export_backends': export_backends,
+            'repeats': args.repeats,
+        },
+        'skipped': skipped,
+        'metrics': metrics,
+    }
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparison = compare_with_baseline(metrics, baseline.get('metrics', {}), args.threshold)
+        result['comparison'] = {'baseline': args.baseline, 'threshold': args.threshold, 'metrics': comparison}
+        print_comparison(comparison)
+        regressions = [metric for metric, row in comparison.items() if row['regressed']]
+    else:
+        for metric, value in sorted(metrics.items()):
+            print(f"{metric:<60} {value:>12.2f}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {args.output}")
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"ベースラインを更新しました: {args.baseline}")
+
+    if regressions:
+        print(f"退行: {len(regressions)}項目")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
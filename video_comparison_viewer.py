@@ -1,55 +1,2196 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import cv2
-import numpy as np
-from PIL import Image, ImageTk
 import threading
+import queue
 import time
 import os
 import subprocess
 import platform
-from tkinterdnd2 import DND_FILES, TkinterDnD
+import hashlib
+import shutil
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
+import importlib
+import math
+import itertools
+import argparse
+import json
+import sys
+
+class _LazyModule:
+    # 最初に属性を参照した時点でimportする（起動を速くし、ヘッドレス保存ではTkやtkinterdnd2を読み込まない）
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        setattr(self, attr, value)  # 2回目からは通常の属性として参照する
+        return value
+
+cv2 = _LazyModule('cv2')
+np = _LazyModule('numpy')
+tk = _LazyModule('tkinter')
+ttk = _LazyModule('tkinter.ttk')
+filedialog = _LazyModule('tkinter.filedialog')
+messagebox = _LazyModule('tkinter.messagebox')
+Image = _LazyModule('PIL.Image')
+ImageTk = _LazyModule('PIL.ImageTk')
+tkinterdnd2 = _LazyModule('tkinterdnd2')
+
+def get_cache_dir(name):
+    # インデックスなどを保存するキャッシュディレクトリ
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'video_comparison_viewer', name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def file_signature(video_path):
+    # ファイルの変更検出用（サイズと更新日時）
+    st = os.stat(video_path)
+    return st.st_size, st.st_mtime_ns
+
+def cache_file_name(video_path, suffix):
+    digest = hashlib.sha1(os.path.abspath(video_path).encode('utf-8')).hexdigest()
+    return digest + suffix
+
+class VideoIndex:
+    # キーフレーム位置と各フレームのタイムスタンプのインデックス
+    VERSION = 1
+    
+    def __init__(self, keyframes, pts_ms):
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)  # キーフレームのフレーム番号（昇順）
+        self.pts_ms = np.asarray(pts_ms, dtype=np.float64)  # 表示順の各フレームのタイムスタンプ
+        self.frame_count = len(self.pts_ms)
+    
+    @classmethod
+    def load_or_build(cls, video_path):
+        # キャッシュがあれば読み込み、なければスキャンして保存する
+        index_path = os.path.join(get_cache_dir('index'), cache_file_name(video_path, '.npz'))
+        signature = file_signature(video_path)
+        index = cls.load(index_path, signature)
+        if index is None:
+            index = cls.build(video_path)
+            if index is not None:
+                index.save(index_path, signature)
+        return index
+    
+    @classmethod
+    def load(cls, index_path, signature):
+        try:
+            with np.load(index_path) as data:
+                stored = tuple(int(v) for v in data['signature'])
+                if int(data['version']) != cls.VERSION or stored != signature:
+                    return None
+                return cls(data['keyframes'], data['pts_ms'])
+        except (OSError, KeyError, ValueError):
+            return None
+    
+    def save(self, index_path, signature):
+        try:
+            tmp_path = index_path + '.tmp.npz'
+            np.savez(tmp_path, version=self.VERSION, signature=np.array(signature, dtype=np.int64),
+                     keyframes=self.keyframes, pts_ms=self.pts_ms)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"インデックス保存エラー: {e}")
+    
+    @classmethod
+    def build(cls, video_path):
+        # デコードせずにパケットだけを読んでキーフレームとタイムスタンプを集める
+        # キーフレームの判定ができない古いOpenCVではインデックスなし（シークはOpenCVに任せる）
+        if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+            return None
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        try:
+            if not cap.isOpened() or cap.get(cv2.CAP_PROP_FORMAT) != -1:
+                return None
+            packet_pts = []
+            key_pts = []
+            while cap.grab():
+                pts = cap.get(cv2.CAP_PROP_POS_MSEC)
+                packet_pts.append(pts)
+                if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                    key_pts.append(pts)
+        finally:
+            cap.release()
+        
+        if not packet_pts:
+            return None
+        # パケットはデコード順なので表示順に並べ替えてからキーフレームの番号を求める
+        pts_ms = np.sort(np.array(packet_pts, dtype=np.float64))
+        keyframes = np.unique(np.searchsorted(pts_ms, np.array(key_pts, dtype=np.float64)))
+        if len(keyframes) == 0 or keyframes[0] != 0:
+            keyframes = np.concatenate(([0], keyframes))
+        return cls(keyframes, pts_ms)
+    
+    def keyframe_before(self, frame_number):
+        # frame_number以前で最も近いキーフレーム
+        i = np.searchsorted(self.keyframes, frame_number, side='right') - 1
+        return int(self.keyframes[max(0, i)])
+    
+    def frame_at_msec(self, msec):
+        # タイムスタンプに最も近いフレーム番号
+        i = int(np.searchsorted(self.pts_ms, msec))
+        if i >= self.frame_count:
+            return self.frame_count - 1
+        if i > 0 and msec - self.pts_ms[i - 1] < self.pts_ms[i] - msec:
+            return i - 1
+        return i
+
+class VideoProbe:
+    # 読み込み中の表示に使う動画の情報（ファイルが変わっていなければキャッシュから読む）
+    VERSION = 1
+    
+    def __init__(self, frame_count, fps, width, height):
+        self.frame_count = int(frame_count)
+        self.fps = float(fps)
+        self.width = int(width)
+        self.height = int(height)
+    
+    @staticmethod
+    def cache_path(video_path):
+        return os.path.join(get_cache_dir('probe'), cache_file_name(video_path, '.json'))
+    
+    @classmethod
+    def from_capture(cls, cap):
+        return cls(cap.get(cv2.CAP_PROP_FRAME_COUNT), cap.get(cv2.CAP_PROP_FPS),
+                   cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    @classmethod
+    def load(cls, probe_path, signature):
+        try:
+            with open(probe_path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] != cls.VERSION or tuple(data['signature']) != tuple(signature):
+                return None
+            return cls(data['frame_count'], data['fps'], data['width'], data['height'])
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+    
+    def save(self, probe_path, signature):
+        try:
+            tmp_path = probe_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'signature': list(signature), 'frame_count': self.frame_count,
+                           'fps': self.fps, 'width': self.width, 'height': self.height}, f)
+            os.replace(tmp_path, probe_path)
+        except OSError as e:
+            print(f"動画情報の保存エラー: {e}")
+    
+    def describe(self):
+        return f"{self.width}x{self.height} / {self.fps:.2f}fps / {self.frame_count}フレーム"
+
+class ProxyCache:
+    # 表示用の低解像度・全フレームキーフレーム（MJPG）のプロキシ動画のキャッシュ
+    DEFAULT_LIMIT_MB = 8192
+    
+    def __init__(self, limit_mb=DEFAULT_LIMIT_MB):
+        self.limit_bytes = int(limit_mb * 1024 * 1024)
+        self.proxy_dir = get_cache_dir('proxy')
+    
+    def proxy_path_for(self, video_path, size):
+        # ファイル名にサイズと更新日時を含めるので元ファイルが変わると別のプロキシになる
+        file_size, mtime_ns = file_signature(video_path)
+        prefix = cache_file_name(video_path, '')
+        return os.path.join(self.proxy_dir, f"{prefix}_{size[0]}x{size[1]}_{file_size}_{mtime_ns}.avi")
+    
+    def get_or_create(self, video_path, size, cancel_event=None, progress_callback=None):
+        proxy_path = self.proxy_path_for(video_path, size)
+        if os.path.exists(proxy_path):
+            os.utime(proxy_path)  # LRU削除用に最終使用日時を更新
+            return proxy_path
+        
+        self.remove_stale(video_path)
+        if not self.transcode(video_path, proxy_path, size, cancel_event, progress_callback):
+            return None
+        self.enforce_limit(keep=proxy_path)
+        return proxy_path
+    
+    def transcode(self, video_path, proxy_path, size, cancel_event=None, progress_callback=None):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        tmp_path = proxy_path + '.tmp.avi'
+        out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+        completed = False
+        try:
+            frame_number = 0
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+                frame_number += 1
+                if progress_callback and frame_number % 30 == 0:
+                    progress_callback(frame_number, total)
+            completed = frame_number > 0
+        finally:
+            cap.release()
+            out.release()
+            if completed:
+                os.replace(tmp_path, proxy_path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return completed
+    
+    def remove_stale(self, video_path):
+        # 同じ元ファイルの古いプロキシ（元ファイル変更前のもの）を削除
+        file_size, mtime_ns = file_signature(video_path)
+        prefix = cache_file_name(video_path, '') + '_'
+        current = f"_{file_size}_{mtime_ns}.avi"
+        for name in os.listdir(self.proxy_dir):
+            if name.startswith(prefix) and not name.endswith(current):
+                try:
+                    os.remove(os.path.join(self.proxy_dir, name))
+                except OSError:
+                    pass
+    
+    def enforce_limit(self, keep=None):
+        # 合計サイズが上限を超えたら最終使用日時の古いものから削除
+        entries = []
+        for name in os.listdir(self.proxy_dir):
+            path = os.path.join(self.proxy_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+class FrameCache:
+    # デコード・リサイズ済みフレームのLRUキャッシュ（メモリ上限付き）
+    DEFAULT_BUDGET_MB = 1024
+    
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.used_bytes = 0
+        self._frames = OrderedDict()  # (動画パス, フレーム番号, タイルサイズ, 表示範囲) -> フレーム
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, video_path, frame_number, size, roi=None):
+        key = (video_path, frame_number, tuple(size), roi)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.stats['misses'] += 1
+                return None
+            self._frames.move_to_end(key)
+            self.stats['hits'] += 1
+            return frame
+    
+    def put(self, video_path, frame_number, size, frame, roi=None):
+        if frame.nbytes > self.budget_bytes:
+            return
+        key = (video_path, frame_number, tuple(size), roi)
+        # 共有されるフレームが書き換えられないように読み取り専用にする
+        frame.flags.writeable = False
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old.nbytes
+            self._frames[key] = frame
+            self.used_bytes += frame.nbytes
+            # 上限を超えたら古いものから削除
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.used_bytes -= evicted.nbytes
+                self.stats['evictions'] += 1
+    
+    def set_budget(self, budget_mb):
+        with self._lock:
+            self.budget_bytes = int(budget_mb * 1024 * 1024)
+            while self.used_bytes > self.budget_bytes and self._frames:
+                _, evicted = self._frames.popitem(last=False)
+                self.used_bytes -= evicted.nbytes
+                self.stats['evictions'] += 1
+    
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.used_bytes = 0
+    
+    def discard(self, video_path, size=None):
+        # 指定した動画（とタイルサイズ）のフレームを削除
+        with self._lock:
+            for key in [k for k in self._frames if k[0] == video_path and (size is None or k[2] == tuple(size))]:
+                self.used_bytes -= self._frames.pop(key).nbytes
+    
+    @property
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+def lower_thread_priority():
+    # 呼び出したスレッドの優先度を下げる（Linuxではスレッドごとにnice値を設定できる）
+    if platform.system() != 'Linux' or not hasattr(threading, 'get_native_id'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except OSError:
+        pass
+
+class ThumbnailStore:
+    # タイムライン表示用に一定間隔で取り出した縮小フレーム（1つの配列にまとめ、ファイルごとにディスクへキャッシュ）
+    VERSION = 1
+    HEIGHT = 54
+    MAX_WIDTH = 128
+    COUNT = 200  # 1本の動画から取り出す最大枚数
+    
+    def __init__(self, frame_numbers, thumbnails):
+        self.frame_numbers = np.asarray(frame_numbers, dtype=np.int64)  # 各サムネイルのフレーム番号（昇順）
+        self.thumbnails = np.ascontiguousarray(thumbnails, dtype=np.uint8)  # (枚数, 高さ, 幅, 3) のRGB
+        self.size = (self.thumbnails.shape[2], self.thumbnails.shape[1])
+    
+    @classmethod
+    def load_or_build(cls, video_path, index=None, should_pause=None, cancel_event=None):
+        # キャッシュがあれば読み込み、なければ作成して保存する
+        store_path = os.path.join(get_cache_dir('thumbnails'), cache_file_name(video_path, '.npz'))
+        signature = file_signature(video_path)
+        store = cls.load(store_path, signature)
+        if store is None:
+            store = cls.build(video_path, index, should_pause, cancel_event)
+            if store is not None:
+                store.save(store_path, signature)
+        return store
+    
+    @classmethod
+    def load(cls, store_path, signature):
+        try:
+            with np.load(store_path) as data:
+                stored = tuple(int(v) for v in data['signature'])
+                if int(data['version']) != cls.VERSION or stored != signature:
+                    return None
+                return cls(data['frame_numbers'], data['thumbnails'])
+        except (OSError, KeyError, ValueError):
+            return None
+    
+    def save(self, store_path, signature):
+        try:
+            tmp_path = store_path + '.tmp.npz'
+            np.savez(tmp_path, version=self.VERSION, signature=np.array(signature, dtype=np.int64),
+                     frame_numbers=self.frame_numbers, thumbnails=self.thumbnails)
+            os.replace(tmp_path, store_path)
+        except OSError as e:
+            print(f"サムネイル保存エラー: {e}")
+    
+    @classmethod
+    def build(cls, video_path, index=None, should_pause=None, cancel_event=None):
+        # 表示用とは別のデコーダ（デコードスレッド1つ）で読む。should_pause()が真の間は待つ
+        cap = open_capture(video_path, 1)
+        try:
+            frame_count = index.frame_count if index is not None else int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if frame_count <= 0:
+                return None
+            count = min(cls.COUNT, frame_count)
+            interval = frame_count / count
+            targets = []
+            for i in range(count):
+                target = int(i * interval)
+                if index is not None:
+                    # 近くにキーフレームがあればそれを使う（シーク後に1枚デコードするだけで済む）
+                    keyframe = index.keyframe_before(target)
+                    if target - keyframe <= interval / 2:
+                        target = keyframe
+                if not targets or target > targets[-1]:
+                    targets.append(target)
+            
+            frame_numbers = []
+            thumbnails = []
+            size = None
+            for target in targets:
+                while should_pause is not None and should_pause():
+                    if cancel_event is not None and cancel_event.is_set():
+                        return None
+                    time.sleep(0.1)
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                ret, frame = cap.read()
+                if not ret:
+                    continue
+                if size is None:
+                    h, w = frame.shape[:2]
+                    size = (max(1, min(cls.MAX_WIDTH, round(w * cls.HEIGHT / h))), cls.HEIGHT)
+                thumbnail = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                thumbnails.append(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB))
+                frame_numbers.append(target)
+        finally:
+            cap.release()
+        
+        if not thumbnails:
+            return None
+        return cls(frame_numbers, np.stack(thumbnails))
+    
+    def nearest(self, frame_number):
+        # frame_number以前で最も近いサムネイル
+        i = np.searchsorted(self.frame_numbers, frame_number, side='right') - 1
+        return self.thumbnails[max(0, i)]
+
+def compute_diff_metrics(reference, frames, with_ssim=False, block=8):
+    # (枚数, 高さ, 幅, 3) のフレームのバッチをまとめて比較し、フレームごとの平均絶対差・PSNR・ブロックSSIMを返す
+    reference = reference.astype(np.float32)
+    frames = frames.astype(np.float32)
+    diff = reference - frames
+    mad = np.abs(diff).mean(axis=(1, 2, 3))
+    mse = (diff * diff).mean(axis=(1, 2, 3))
+    psnr = np.full_like(mse, DiffMetrics.PSNR_MAX)
+    nonzero = mse > 0
+    psnr[nonzero] = np.minimum(10 * np.log10(255.0 ** 2 / mse[nonzero]), DiffMetrics.PSNR_MAX)
+    if not with_ssim:
+        return mad, psnr, None
+    
+    # 輝度をblock×blockのブロックに分け、ブロックごとの平均・分散・共分散からSSIMを求めて平均する
+    weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    x = reference @ weights
+    y = frames @ weights
+    n, h, w = x.shape
+    h -= h % block
+    w -= w % block
+    x = x[:, :h, :w].reshape(n, h // block, block, w // block, block)
+    y = y[:, :h, :w].reshape(n, h // block, block, w // block, block)
+    mean_x = x.mean(axis=(2, 4), keepdims=True)
+    mean_y = y.mean(axis=(2, 4), keepdims=True)
+    dx = x - mean_x
+    dy = y - mean_y
+    var_x = (dx * dx).mean(axis=(2, 4))
+    var_y = (dy * dy).mean(axis=(2, 4))
+    cov = (dx * dy).mean(axis=(2, 4))
+    mean_x = mean_x[:, :, 0, :, 0]
+    mean_y = mean_y[:, :, 0, :, 0]
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / \
+               ((mean_x * mean_x + mean_y * mean_y + c1) * (var_x + var_y + c2))
+    return mad, psnr, ssim_map.mean(axis=(1, 2))
+
+def read_downsampled_batch(cap, count, size):
+    # capから最大count枚を読み、解析用のサイズに縮小してまとめる（BGRのまま）
+    frames = []
+    for _ in range(count):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    if not frames:
+        return np.empty((0, size[1], size[0], 3), dtype=np.uint8)
+    return np.stack(frames)
+
+class DiffMetrics:
+    # 基準動画とのフレームごとの差分指標（同じフレーム番号同士を比較。比較動画が短い場合はNaN）
+    VERSION = 1
+    ANALYSIS_SIZE = (256, 144)  # 指標を計算する縮小サイズ
+    BATCH = 32  # まとめて計算するフレーム数
+    PSNR_MAX = 100.0  # 完全に一致したフレームのPSNR
+    
+    def __init__(self, mad, psnr, ssim=None):
+        self.mad = np.asarray(mad, dtype=np.float32)
+        self.psnr = np.asarray(psnr, dtype=np.float32)
+        self.ssim = None if ssim is None else np.asarray(ssim, dtype=np.float32)
+        self.frame_count = len(self.mad)
+    
+    @staticmethod
+    def cache_path(reference_path, other_path):
+        name = cache_file_name(reference_path, '_') + cache_file_name(other_path, '.npz')
+        return os.path.join(get_cache_dir('diff'), name)
+    
+    @classmethod
+    def load(cls, cache_path, signature, with_ssim=False):
+        try:
+            with np.load(cache_path) as data:
+                stored = tuple(int(v) for v in data['signature'])
+                if int(data['version']) != cls.VERSION or stored != signature:
+                    return None
+                if with_ssim and 'ssim' not in data:
+                    return None
+                return cls(data['mad'], data['psnr'], data['ssim'] if 'ssim' in data else None)
+        except (OSError, KeyError, ValueError):
+            return None
+    
+    def save(self, cache_path, signature):
+        try:
+            tmp_path = cache_path + '.tmp.npz'
+            arrays = {'mad': self.mad, 'psnr': self.psnr}
+            if self.ssim is not None:
+                arrays['ssim'] = self.ssim
+            np.savez(tmp_path, version=self.VERSION, signature=np.array(signature, dtype=np.int64), **arrays)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"差分解析の保存エラー: {e}")
+    
+    @classmethod
+    def analyze(cls, reference_path, other_paths, with_ssim=False, executor=None, cancel_event=None,
+                progress_callback=None):
+        # 動画パス -> DiffMetrics を返す（中断されたらNone）
+        # キャッシュのあるペアは読み込むだけにし、残りは基準動画を1回だけ先頭から読みながら全ペアを同時に計算する
+        results = {}
+        signatures = {}
+        missing = []
+        reference_signature = file_signature(reference_path)
+        for path in other_paths:
+            signatures[path] = reference_signature + file_signature(path)
+            cached = cls.load(cls.cache_path(reference_path, path), signatures[path], with_ssim)
+            if cached is not None:
+                results[path] = cached
+            else:
+                missing.append(path)
+        if not missing:
+            return results
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=min(len(missing) + 1, os.cpu_count() or 1))
+        caps = [cv2.VideoCapture(path) for path in [reference_path] + missing]
+        total = int(caps[0].get(cv2.CAP_PROP_FRAME_COUNT))
+        parts = {path: [] for path in missing}
+        done = 0
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                # 各動画の次のバッチを並列に読んで縮小する（OpenCVはデコード中GILを解放する）
+                batches = list(executor.map(lambda cap: read_downsampled_batch(cap, cls.BATCH, cls.ANALYSIS_SIZE),
+                                            caps))
+                reference = batches[0]
+                count = len(reference)
+                if count == 0:
+                    break
+                futures = {path: executor.submit(compute_diff_metrics, reference[:len(batch)], batch, with_ssim)
+                           for path, batch in zip(missing, batches[1:]) if len(batch)}
+                for path, batch in zip(missing, batches[1:]):
+                    values = [np.full(count, np.nan, dtype=np.float32) for _ in range(3)]
+                    if path in futures:
+                        for values_row, computed in zip(values, futures[path].result()):
+                            if computed is not None:
+                                values_row[:len(batch)] = computed
+                    parts[path].append(values)
+                done += count
+                if progress_callback:
+                    progress_callback(done, max(total, done))
+        finally:
+            for cap in caps:
+                cap.release()
+            if own_executor:
+                executor.shutdown()
+        
+        for path in missing:
+            mad, psnr, ssim = (np.concatenate([values[k] for values in parts[path]]) for k in range(3))
+            result = cls(mad, psnr, ssim if with_ssim else None)
+            result.save(cls.cache_path(reference_path, path), signatures[path])
+            results[path] = result
+        return results
+    
+    def metrics_at(self, frame_number):
+        # 表示用の文字列（範囲外ならNone）
+        if not 0 <= frame_number < self.frame_count or np.isnan(self.mad[frame_number]):
+            return None
+        text = f"MAD {self.mad[frame_number]:.2f} / PSNR {self.psnr[frame_number]:.1f}dB"
+        if self.ssim is not None:
+            text += f" / SSIM {self.ssim[frame_number]:.3f}"
+        return text
+
+class PerfTracer:
+    # 処理段階ごとの所要時間の記録（HUD表示とバグ報告用のChromeトレース出力）
+    # 無効な間はbegin()がNoneを返すだけなので計測のコストはほぼない
+    WINDOW = 60  # HUDの平均に使う直近のサンプル数
+    MAX_EVENTS = 1000000  # トレースに記録するイベント数の上限
+
+    def __init__(self):
+        self.enabled = False  # 段階ごとの時間を集計する（HUD表示中やトレース中）
+        self.tracing = False  # トレースイベントを記録する
+        self.lock = threading.Lock()
+        self.samples = {}  # (段階, タイル) -> 直近の所要時間（秒）
+        self.events = []  # (種類, 名前, タイル, 開始, 終了または値, スレッドID)
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+    
+    def begin(self):
+        return time.perf_counter() if self.enabled else None
+    
+    def end(self, name, t0, tile=None):
+        if t0 is None or not self.enabled:
+            return
+        t1 = time.perf_counter()
+        with self.lock:
+            samples = self.samples.get((name, tile))
+            if samples is None:
+                samples = self.samples[(name, tile)] = deque(maxlen=self.WINDOW)
+            samples.append(t1 - t0)
+            if self.tracing:
+                self._add_event('X', name, tile, t0, t1)
+    
+    def counter(self, name, value, tile=None):
+        # キューの深さなどの値の推移をトレースに記録する
+        if not self.tracing:
+            return
+        with self.lock:
+            self._add_event('C', name, tile, time.perf_counter(), value)
+    
+    def _add_event(self, phase, name, tile, t0, value):
+        if len(self.events) >= self.MAX_EVENTS:
+            return
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        self.events.append((phase, name, tile, t0, value, thread.ident))
+    
+    def mean_ms(self, name, tile=None):
+        samples = self.samples.get((name, tile))
+        if not samples:
+            return None
+        return sum(samples) / len(samples) * 1000
+    
+    def start_trace(self):
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.origin = time.perf_counter()
+            self.tracing = True
+            self.enabled = True
+    
+    def stop_trace(self, keep_enabled=False):
+        self.tracing = False
+        self.enabled = keep_enabled
+    
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+    
+    def dump_chrome_trace(self, path):
+        # chrome://tracing や Perfetto で開ける形式で書き出す
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                        for tid, name in thread_names.items()]
+        for phase, name, tile, t0, value, tid in events:
+            event = {'name': name, 'ph': phase, 'pid': pid, 'tid': tid,
+                     'ts': (t0 - self.origin) * 1e6}
+            if phase == 'X':
+                event['dur'] = (value - t0) * 1e6
+                if tile is not None:
+                    event['args'] = {'tile': tile}
+            else:
+                event['name'] = name if tile is None else f"{name} {tile}"
+                event['args'] = {'value': value}
+            trace_events.append(event)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+# 全体で共有する計測器（表示・先読みスレッド・保存処理から使う）
+perf_tracer = PerfTracer()
+
+def crop_roi(frame, roi):
+    # 表示範囲 (x, y, 幅, 高さ)（元フレームに対する0～1の比率）を切り出す。コピーせずビューを返す
+    if roi is None:
+        return frame
+    height, width = frame.shape[:2]
+    x0 = min(width - 1, int(roi[0] * width))
+    y0 = min(height - 1, int(roi[1] * height))
+    x1 = max(x0 + 1, min(width, math.ceil((roi[0] + roi[2]) * width)))
+    y1 = max(y0 + 1, min(height, math.ceil((roi[1] + roi[3]) * height)))
+    return frame[y0:y1, x0:x1]
+
+def parse_roi(text):
+    # "x,y,幅,高さ"（0～1の比率。ジョブ定義ファイルではリストも可）を表示範囲にする（空ならNone）
+    if not text:
+        return None
+    values = text.split(',') if isinstance(text, str) else text
+    x, y, w, h = (float(value) for value in values)
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > 1 + 1e-9 or y + h > 1 + 1e-9:
+        raise ValueError(f"不正な表示範囲です: {text}")
+    return (x, y, w, h)
+
+def build_timeline(sources, offsets=None):
+    # 全タイル共通の時計（マスターのフレーム番号）から各タイルのフレーム番号への対応表を作る
+    # sources: タイルごとの (フレーム数, fps, 各フレームのタイムスタンプ[ミリ秒]またはNone)
+    # offsets: タイルごとの開始の遅れ（秒、負なら先に進める）
+    # マスターのfpsは最も高いfps（どのタイルのフレームも飛ばさない）。対応表はタイルごとのnp.int32の配列で、
+    # 開始前は-1、終了後はそのタイルのフレーム数になる（単調増加）。(マスターのfps, 対応表のリスト) を返す
+    offsets = list(offsets or []) + [0.0] * (len(sources) - len(offsets or []))
+    fps = max((source_fps for _, source_fps, _ in sources if source_fps and source_fps > 0), default=30.0)
+    tiles = []
+    length = 0
+    for (frame_count, source_fps, pts_ms), offset in zip(sources, offsets):
+        if not source_fps or source_fps <= 0:
+            source_fps = fps
+        if pts_ms is not None and len(pts_ms) == frame_count and frame_count > 0:
+            # タイムスタンプがあれば可変フレームレートでも正しく対応させる
+            pts = np.asarray(pts_ms, dtype=np.float64) - pts_ms[0]
+            end_ms = pts[-1] + 1000.0 / source_fps
+        else:
+            pts = None
+            end_ms = frame_count * 1000.0 / source_fps
+        tiles.append((frame_count, source_fps, pts, offset * 1000.0))
+        length = max(length, math.ceil((offset * 1000.0 + end_ms) * fps / 1000.0 - 1e-6))
+    
+    # マスターの半フレーム以内の差は同じ時刻とみなす（同じfpsの動画どうしはフレーム番号がそのまま対応する）
+    times_ms = np.arange(max(0, length), dtype=np.float64) * (1000.0 / fps) + 500.0 / fps
+    tables = []
+    for frame_count, source_fps, pts, offset_ms in tiles:
+        t = times_ms - offset_ms
+        if pts is not None:
+            table = np.searchsorted(pts, t, side='right') - 1
+            table[t >= pts[-1] + 1000.0 / source_fps] = frame_count
+        else:
+            table = np.floor(t * source_fps / 1000.0)
+        tables.append(np.clip(table, -1, frame_count).astype(np.int32))
+    return fps, tables
+
+def map_timeline(timeline, frame_number, frame_count):
+    # 全体の時計のフレーム番号をタイルのフレーム番号にする（対応表がなければそのまま）
+    if timeline is None:
+        return frame_number
+    if frame_number >= len(timeline):
+        return frame_count
+    return int(timeline[frame_number])
+
+def first_step_reaching(timeline, need, start_frame, stride, every):
+    # 先読みのステップのうち、タイルのフレーム番号がneed以上になる最初のもの
+    frame_number = need if timeline is None else int(np.searchsorted(timeline, need))
+    ticks = math.ceil((frame_number - start_frame) / stride - 1e-9)
+    return max(0, math.ceil(ticks / every))
+
+def stride_frame(start_frame, step, stride):
+    # 一定間隔（小数可）で読む場合のstep番目のフレーム番号
+    return start_frame + int(step * stride + 1e-9)
+
+def open_capture(video_path, threads=None):
+    # タイルが多いときはデコーダ内部のスレッド数を制限して開く（指定できない古いOpenCVでは既定のまま）
+    if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_N_THREADS, int(threads)])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(video_path)
+
+class DecodePool:
+    # 全タイルで共有する、スレッド数に上限のあるデコードワーカー
+    # タイルは1回に1フレームずつ処理して待ち行列の最後に戻すので、どのタイルも順番に進む
+    # （スクラブ要求と優先タイルは先頭に入れる）
+    def __init__(self, workers):
+        self.workers = max(1, int(workers))
+        self._cond = threading.Condition()
+        self._ready = deque()
+        self._threads = []
+        self._stop = False
+    
+    def schedule(self, player, urgent=False):
+        with self._cond:
+            if self._stop or player._pool_queued or player._pool_busy:
+                return
+            self._enqueue(player, urgent)
+    
+    def _enqueue(self, player, urgent=False):
+        player._pool_queued = True
+        if urgent or player.priority or player._scrub_request is not None:
+            self._ready.appendleft(player)
+        else:
+            self._ready.append(player)
+        if len(self._threads) < self.workers:
+            # ワーカーは必要になった時点で起動する
+            thread = threading.Thread(target=self._worker, name=f"decode worker {len(self._threads) + 1}",
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        self._cond.notify()
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                player = self._ready.popleft()
+                player._pool_queued = False
+                player._pool_busy = True
+            try:
+                player._decode_step()
+            except Exception as e:
+                print(f"デコードエラー ({player.label}): {e}")
+            with self._cond:
+                player._pool_busy = False
+                if not self._stop and player._has_work():
+                    self._enqueue(player)
+    
+    def shutdown(self):
+        with self._cond:
+            self._stop = True
+            self._ready.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
 
 class VideoPlayer:
-    def __init__(self, video_path, position, size):
+    # 前方ジャンプをシークではなくgrab()で読み飛ばす最大フレーム数
+    MAX_GRAB_FORWARD = 30
+    # 再生時の先読みバッファの既定の深さ（フレーム数）
+    PREFETCH_DEPTH = 8
+
+    def __init__(self, video_path, position, size, frame_cache=None, index=None, proxy_path=None, rgb=True,
+                 decode_pool=None, decoder_threads=None, probe=None):
         self.video_path = video_path
         self.position = position  # (x, y)
         self.size = size  # (width, height)
-        self.cap = cv2.VideoCapture(video_path)
-        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_cache = frame_cache  # 共有のFrameCache（Noneならキャッシュしない）
+        self.decoder_threads = decoder_threads  # デコーダ内部のスレッド数（Noneならコーデック任せ）
+        if probe is not None:
+            # キャッシュした動画情報があればデコーダは後からopen_decoderで開く（それまではフレームを返さない）
+            self.cap = None
+            self.frame_count = probe.frame_count
+            self.fps = probe.fps
+        else:
+            self.cap = open_capture(video_path, decoder_threads)
+            self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self._released = False
+        self.index = None  # シークに使うキーフレームインデックス（プロキシ使用中はNone）
+        self.source_index = None  # 元動画のインデックス（読み込み完了後に設定）
+        self.label = os.path.basename(video_path)  # 計測結果を表示するときのタイル名
+        self.proxy_path = None  # 表示に使うプロキシ動画（Noneなら元動画）
+        self.rgb = rgb  # Falseなら色変換せずにBGRのまま返す（保存用）
+        self.roi = None  # 表示範囲（crop_roiの形式、Noneならフレーム全体）。リサイズ前に切り出す
+        self.timeline = None  # 全体の時計からこの動画のフレーム番号への対応表（build_timeline、Noneならそのまま）
         self.current_frame = 0
         self.is_playing = False
+        # デコーダが次にread()で返すフレーム番号（不明な場合はNone）
+        self.decoder_pos = 0
+        # シーク回数と連続読み込み回数の統計
+        self.read_stats = {'seeks': 0, 'sequential_reads': 0, 'grab_skips': 0, 'grabbed_frames': 0}
+        
+        # デコードスレッドと表示側の両方からcapを使うためのロック
+        self.lock = threading.RLock()
+        # 先読みとスクラブのデコードを行うワーカー（共有のDecodePool）
+        self.decode_pool = decode_pool
+        self._own_pool = False
+        self.priority = False  # Trueならワーカーで優先して処理する（フォーカス中のタイル）
+        self._pool_queued = False  # DecodePoolの待ち行列に入っているか
+        self._pool_busy = False  # ワーカーが処理中か
+        self._step_lock = threading.Lock()
+        # 先読みのリングバッファ
+        self.prefetch_depth = self.PREFETCH_DEPTH
+        self._prefetch_active = False
+        self._prefetch_generation = 0
+        self._prefetch_start = 0
+        self._prefetch_stride = 1.0
+        self._prefetch_every = 1
+        self._prefetch_step = 0
+        self._buffer = deque()  # (フレーム番号, RGBフレーム)
+        self._buffer_cond = threading.Condition()
+        self._prefetch_target = 0
+        self._prefetch_last = -1  # 最後に先読みしたフレーム番号
+        self._prefetch_eof = None
+        # 先読みバッファの統計（深さとアンダーラン回数）
+        self.buffer_stats = {'delivered': 0, 'underruns': 0, 'depth_sum': 0, 'min_depth': None}
+        # スクラブの要求（未処理の要求は常に最新の1件だけ）
+        self._scrub_cond = threading.Condition()
+        self._scrub_request = None  # (フレーム番号, 下書きか, 完了時のコールバック)
+        # 先読みを別プロセスで行う場合のデコーダ（Noneならデコードワーカーのスレッドで先読みする）
+        self.process_decoder = None
+        
+        if index is not None:
+            self.set_index(index)
+        if proxy_path is not None:
+            self.set_proxy(proxy_path)
+    
+    @property
+    def decoder_ready(self):
+        return self.cap is not None
+    
+    def open_decoder(self):
+        # 動画情報だけで作ったプレイヤーのデコーダを開く（読み込みワーカーで呼ぶ。開けなければFalse）
+        # 開くのに時間がかかってもその間に表示側を止めないように、ロックは開いた後で取る
+        cap = open_capture(self.video_path, self.decoder_threads)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        with self.lock:
+            if self.cap is None and not self._released:
+                self.cap = cap
+                self.decoder_pos = 0
+                cap = None
+        if cap is not None:
+            cap.release()  # 先にプロキシに切り替わったか、解放済み
+        return True
+    
+    def set_index(self, index):
+        with self.lock:
+            self.source_index = index
+            if self.proxy_path is None:
+                self.index = index
+            # コンテナのフレーム数は不正確なことがあるのでインデックスの値を使う
+            self.frame_count = index.frame_count
+        if self.process_decoder is not None:
+            self.process_decoder.send('index', index)
+    
+    def set_proxy(self, proxy_path):
+        # 表示用のデコーダをプロキシ動画（Noneなら元動画）に切り替える
+        with self.lock:
+            if proxy_path == self.proxy_path:
+                return
+            cap = open_capture(proxy_path if proxy_path is not None else self.video_path, self.decoder_threads)
+            if not cap.isOpened():
+                cap.release()
+                return
+            if self.cap is not None:
+                self.cap.release()
+            self.cap = cap
+            self.proxy_path = proxy_path
+            # プロキシは全フレームがキーフレームなのでインデックスは使わない
+            self.index = self.source_index if proxy_path is None else None
+            self.decoder_pos = 0
+        if self.process_decoder is not None:
+            self.process_decoder.send('proxy', proxy_path)
+        if self.frame_cache is not None:
+            # 解像度の違うフレームが混ざらないようにキャッシュを捨てる
+            self.frame_cache.discard(self.video_path)
         
+    def _position_decoder(self, frame_number, seek_from=None):
+        # デコーダ位置をframe_numberに合わせる（次のフレームなら何もしない）
+        pos = self.decoder_pos
+        if pos == frame_number:
+            self.read_stats['sequential_reads'] += 1
+            return True
+        
+        if pos is not None and pos < frame_number <= pos + self.MAX_GRAB_FORWARD:
+            # 短い前方ジャンプ：grab()で読み飛ばす（retrieveしないので変換コストなし）
+            self.read_stats['grab_skips'] += 1
+            while pos < frame_number:
+                if not self.cap.grab():
+                    self.decoder_pos = None
+                    return False
+                pos += 1
+                self.read_stats['grabbed_frames'] += 1
+            self.decoder_pos = pos
+            return True
+        
+        index = self.index
+        if index is not None:
+            # インデックスがあれば直前のキーフレームへシークしてgrab()で進める
+            keyframe = index.keyframe_before(frame_number if seek_from is None else seek_from)
+            if seek_from is None and pos is not None and keyframe <= pos < frame_number:
+                # 現在位置の方が近い場合はシークせずにそのまま進める
+                keyframe = pos
+            else:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                self.read_stats['seeks'] += 1
+            self.decoder_pos = keyframe
+            while self.decoder_pos < frame_number:
+                if not self.cap.grab():
+                    self.decoder_pos = None
+                    return False
+                self.decoder_pos += 1
+                self.read_stats['grabbed_frames'] += 1
+            return True
+        
+        # 後方ジャンプまたは長距離ジャンプ：シークする
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        self.decoder_pos = frame_number
+        self.read_stats['seeks'] += 1
+        return True
+    
+    def _verify_position(self, frame_number):
+        # 読み込んだフレームのタイムスタンプがインデックスと一致するか確認し、実際の番号を返す
+        index = self.index
+        if index is None or frame_number >= index.frame_count:
+            return frame_number
+        msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        return index.frame_at_msec(msec)
+    
     def get_frame(self, frame_number=None):
-        if frame_number is not None:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            self.current_frame = frame_number
+        roi = self.roi  # 途中で表示範囲が変わっても、切り出しとキャッシュのキーは同じ範囲にする
+        cache = self.frame_cache
+        if cache is not None and frame_number is not None:
+            frame = cache.get(self.video_path, frame_number, self.size, roi)
+            if frame is not None:
+                # キャッシュヒット時はデコードしない（デコーダ位置も動かさない）
+                self.current_frame = frame_number
+                return frame
+        
+        with self.lock:
+            if self.cap is None:
+                return None  # デコーダを開いている途中
+            # キャッシュのキーは他のスレッドに書き換えられないようにロック内で決める
+            size = tuple(self.size)
+            frame, decoded_number = self._read_frame(frame_number, roi, size)
+        if cache is not None and frame is not None and decoded_number is not None:
+            # 位置の確認が取れなかったフレームは別の番号のものかもしれないのでキャッシュしない
+            cache.put(self.video_path, decoded_number, size, frame, roi)
+        return frame
+    
+    def set_roi(self, roi):
+        self.roi = roi
+        if self.process_decoder is not None:
+            self.process_decoder.send('roi', roi)
+    
+    def set_timeline(self, timeline):
+        self.timeline = timeline
+        if self.process_decoder is not None:
+            self.process_decoder.send('timeline', timeline)
+    
+    def map_frame(self, frame_number):
+        # 全体の時計のフレーム番号をこの動画のフレーム番号にする（-1は開始前、frame_count以上は終了後）
+        return map_timeline(self.timeline, frame_number, self.frame_count)
+    
+    def _read_frame(self, frame_number, roi=None, size=None):
+        # (フレーム, 読んだフレーム番号) を返す。番号は位置の確認が取れなかった場合はNone
+        if frame_number is None:
+            frame_number = self.decoder_pos if self.decoder_pos is not None else self.current_frame
+        
+        # シーク先がずれていた場合は位置を補正して読み直す
+        seek_from = None
+        exact = False
+        for _ in range(3):
+            t0 = perf_tracer.begin()
+            positioned = self._position_decoder(frame_number, seek_from)
+            perf_tracer.end('seek', t0, self.label)
+            if not positioned:
+                return None, None
+            t0 = perf_tracer.begin()
+            ret, frame = self.cap.read()
+            perf_tracer.end('decode', t0, self.label)
+            if not ret:
+                break
+            actual = self._verify_position(frame_number)
+            self.decoder_pos = actual + 1
+            exact = actual == frame_number
+            if exact:
+                break
+            if actual > frame_number:
+                # 目的のフレームを通り過ぎたので1つ前のキーフレームからやり直す
+                seek_from = self.index.keyframe_before(frame_number) - 1
+            else:
+                seek_from = None
+        self.current_frame = frame_number
         
-        ret, frame = self.cap.read()
         if ret:
-            # フレームをリサイズ
-            frame = cv2.resize(frame, self.size)
+            # 表示範囲だけを切り出してからリサイズする（拡大するほど処理する画素が減る）
+            t0 = perf_tracer.begin()
+            frame = cv2.resize(crop_roi(frame, roi), size or tuple(self.size))
+            perf_tracer.end('resize', t0, self.label)
             # BGRからRGBに変換
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            return frame
+            if self.rgb:
+                t0 = perf_tracer.begin()
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                perf_tracer.end('cvtColor', t0, self.label)
+            return frame, frame_number if exact else None
+        # 読み込みに失敗した場合は位置が不明なので次回はシークさせる
+        self.decoder_pos = None
+        return None, None
+    
+    def start_prefetch(self, start_frame, depth=None, stride=1.0, every=1, first_frame=None):
+        # start_frameから先のフレームをデコードワーカーでデコードしてバッファに貯める
+        # strideが1より大きい場合は表示するフレームだけを処理し、間のフレームはgrab()で読み飛ばす
+        # everyが2以上なら表示フレームのevery枚に1枚だけを読む（フォーカス外のタイルの更新頻度を下げる）
+        # first_frameを指定するとそれより前のフレームは読まない（再生の途中から先読みし直す場合）
+        self.stop_prefetch()
+        if depth is not None:
+            self.prefetch_depth = max(1, int(depth))
+        # 開始位置は全体の時計のフレーム番号、先読みの目標はこの動画のフレーム番号
+        target = self.map_frame(start_frame if first_frame is None else max(start_frame, first_frame))
+        if self.process_decoder is not None:
+            self.process_decoder.start(start_frame, max(1.0, stride), max(1, int(every)), target)
+            return
+        with self._buffer_cond:
+            self._buffer.clear()
+            self._prefetch_target = target
+            self._prefetch_last = -1
+            self._prefetch_eof = None
+            self._prefetch_start = start_frame
+            self._prefetch_stride = max(1.0, stride)
+            self._prefetch_every = max(1, int(every))
+            self._prefetch_step = 0
+            self._prefetch_active = True
+        self._get_decode_pool().schedule(self)
+    
+    def stop_prefetch(self):
+        if self.process_decoder is not None:
+            self.process_decoder.stop()
+        with self._buffer_cond:
+            was_active = self._prefetch_active
+            self._prefetch_active = False
+            self._prefetch_generation += 1  # デコード中の結果はバッファに入れない
+            self._buffer_cond.notify_all()
+        if was_active:
+            # 古い設定（サイズなど）でのデコードが終わるのを待つ
+            with self._step_lock:
+                pass
+        with self._buffer_cond:
+            self._buffer.clear()
+    
+    def _get_decode_pool(self):
+        # 共有のプールがなければこのプレイヤー専用のワーカーを1つ使う
+        if self.decode_pool is None:
+            self.decode_pool = DecodePool(1)
+            self._own_pool = True
+        return self.decode_pool
+    
+    def _prefetch_frame(self, step):
+        return self.map_frame(stride_frame(self._prefetch_start, step * self._prefetch_every, self._prefetch_stride))
+    
+    def _has_work(self):
+        # デコードワーカーに処理してもらうことがあるか（スクラブ要求か、先読みバッファの空き）
+        if self._scrub_request is not None:
+            return True
+        return self._prefetch_active and self._prefetch_eof is None and len(self._buffer) < self.prefetch_depth
+    
+    def _decode_step(self):
+        # デコードワーカーから呼ばれ、1フレームだけ処理する（スクラブ要求を先読みより優先）
+        result = None
+        with self._step_lock:
+            with self._scrub_cond:
+                request = self._scrub_request
+                self._scrub_request = None
+            if request is not None:
+                result = self._process_scrub(request)
+            else:
+                self._prefetch_one()
+        # スクラブの結果はロックを放してから渡す。コールバックはTkのスレッドの処理を待つことがあり、
+        # Tkのスレッドはstop_scrubやstop_prefetchでこのロックを待つことがあるので、持ったまま呼ぶと止まる
+        if result is not None:
+            callback, args = result
+            callback(*args)
+    
+    def _prefetch_one(self):
+        # 先読みを1フレーム進める（_step_lockを持って呼ぶ）
+        with self._buffer_cond:
+            if not self._prefetch_active or self._prefetch_eof is not None \
+                    or len(self._buffer) >= self.prefetch_depth:
+                return
+            generation = self._prefetch_generation
+            # 表示側に追い越されていたら目標位置まで進め、前と同じフレームや開始前のフレームは読まない
+            frame_number = self._prefetch_frame(self._prefetch_step)
+            need = max(self._prefetch_target, self._prefetch_last + 1, 0)
+            if frame_number < need:
+                self._prefetch_step = first_step_reaching(self.timeline, need, self._prefetch_start,
+                                                          self._prefetch_stride, self._prefetch_every)
+                frame_number = self._prefetch_frame(self._prefetch_step)
+            self._prefetch_step += 1
+            self._prefetch_last = frame_number
+        
+        # デコード中はバッファのロックを保持しない（OpenCVはデコード中GILを解放する）
+        frame = self.get_frame(frame_number)
+        
+        with self._buffer_cond:
+            if generation != self._prefetch_generation:
+                return
+            if frame is None:
+                self._prefetch_eof = frame_number
+            else:
+                self._buffer.append((frame_number, frame))
+            self._buffer_cond.notify_all()
+    
+    def iter_frames(self, frame_numbers):
+        # 昇順のフレーム番号列を順に読む。間のフレームはgrab()で読み飛ばし（retrieve・リサイズ・色変換なし）、
+        # 同じ番号が続く場合はデコードし直さない
+        last_frame_number = None
+        frame = None
+        for frame_number in frame_numbers:
+            if frame_number != last_frame_number:
+                frame = self.get_frame(frame_number)
+                last_frame_number = frame_number
+            yield frame_number, frame
+    
+    def request_scrub(self, frame_number, draft, callback):
+        # スライダー操作中の表示要求。まだ処理していない古い要求は新しい要求で置き換える
+        # draftなら直前のキーフレームだけをデコードし（grabで進めない）、callback(player, 要求番号, 実際の番号, フレーム)を呼ぶ
+        with self._scrub_cond:
+            self._scrub_request = (frame_number, draft, callback)
+        self._get_decode_pool().schedule(self, urgent=True)
+    
+    def _process_scrub(self, request):
+        frame_number, draft, callback = request
+        target = frame_number
+        index = self.index
+        if draft and index is not None:
+            target = min(index.keyframe_before(frame_number), frame_number)
+        roi = self.roi
+        frame = self.get_frame(target)
+        
+        with self._scrub_cond:
+            # デコード中に新しい要求が来ていたり表示範囲が変わっていたら結果は捨てる
+            stale = self._scrub_request is not None or self.roi != roi
+        if not stale:
+            return callback, (self, frame_number, target, frame)
         return None
     
+    def stop_scrub(self):
+        with self._scrub_cond:
+            self._scrub_request = None
+        with self._step_lock:
+            pass
+    
+    def get_buffered_frame(self, frame_number, timeout=0.0):
+        # 先読みバッファからframe_numberのフレームを取り出す（なければNone）
+        if self.process_decoder is not None:
+            return self.process_decoder.get_frame(frame_number, timeout, self.buffer_stats)
+        deadline = time.time() + timeout
+        with self._buffer_cond:
+            self._prefetch_target = max(self._prefetch_target, frame_number)
+            while True:
+                # 表示済みの古いフレームは捨てる
+                while self._buffer and self._buffer[0][0] < frame_number:
+                    self._buffer.popleft()
+                    self._buffer_cond.notify_all()
+                
+                depth = len(self._buffer)
+                if self._buffer and self._buffer[0][0] == frame_number:
+                    _, frame = self._buffer.popleft()
+                    self._buffer_cond.notify_all()
+                    self._get_decode_pool().schedule(self)  # 空いた分を先読みさせる
+                    stats = self.buffer_stats
+                    stats['delivered'] += 1
+                    stats['depth_sum'] += depth
+                    if stats['min_depth'] is None or depth < stats['min_depth']:
+                        stats['min_depth'] = depth
+                    return frame
+                
+                if self._prefetch_eof is not None and frame_number >= self._prefetch_eof:
+                    return None
+                
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._prefetch_active:
+                    self.buffer_stats['underruns'] += 1
+                    return None
+                self._get_decode_pool().schedule(self)
+                self._buffer_cond.wait(remaining)
+    
+    @property
+    def buffer_depth(self):
+        if self.process_decoder is not None:
+            return len(self.process_decoder.buffer)
+        return len(self._buffer)
+    
+    def set_process_decode(self, enabled, depth=None):
+        # 再生時の先読みを別プロセスで行うかを切り替える（サイズが変わった場合はプロセスを作り直す）
+        decoder = self.process_decoder
+        if decoder is not None and (not enabled or tuple(decoder.size) != tuple(self.size)):
+            self.stop_prefetch()
+            decoder.close()
+            self.process_decoder = decoder = None
+        if enabled and decoder is None:
+            self.stop_prefetch()
+            self.process_decoder = ProcessDecoder(self.video_path, self.size, self.source_index, self.proxy_path,
+                                                  (depth or self.prefetch_depth) + 2, self.decoder_threads, self.roi)
+            if self.timeline is not None:
+                self.process_decoder.send('timeline', self.timeline)
+    
+    def set_geometry(self, position, size):
+        # レイアウト変更時は位置とサイズだけを更新する（デコーダは開き直さない）
+        self.position = position
+        if tuple(size) == tuple(self.size):
+            return
+        self.stop_prefetch()  # 古いサイズで先読みしたフレームを捨てる
+        old_size = self.size
+        self.size = size
+        if self.frame_cache is not None:
+            self.frame_cache.discard(self.video_path, old_size)
+        if self.process_decoder is not None:
+            self.set_process_decode(True, len(self.process_decoder.slots) - 2)
+    
+    def release(self):
+        self.stop_prefetch()
+        self.stop_scrub()
+        with self.lock:
+            self._released = True
+            if self.cap is not None:
+                self.cap.release()
+        if self._own_pool:
+            self.decode_pool.shutdown()
+        if self.process_decoder is not None:
+            self.process_decoder.close()
+            self.process_decoder = None
+
+class ProcessDecoder:
+    # 再生時の先読み（デコード・リサイズ・色変換）を別プロセスで行い、フレームを共有メモリのスロットで受け取る
+    # UIプロセスのGILを使わず、受け取ったフレームはコピーせずにスロットをそのまま参照する
+    # 制御用のキューで送るのはフレーム番号とスロット番号だけ。表示中のフレームのスロットは次のフレームを
+    # 受け取るまで返さない（それまでワーカーに上書きされない）
+    def __init__(self, video_path, size, index, proxy_path, slot_count, decoder_threads=None, roi=None):
+        width, height = size
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_count * height * width * 3)
+        self.slots = np.ndarray((slot_count, height, width, 3), dtype=np.uint8, buffer=self.shm.buf)
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=run_decode_process, name=f"decode {os.path.basename(video_path)}",
+                                       args=(video_path, size, index, proxy_path, self.shm.name, slot_count,
+                                             decoder_threads, roi, self.requests, self.results),
+                                       daemon=True)
+        self.process.start()
+        self.generation = 0
+        self.active = False
+        self.eof = None
+        self.buffer = deque()  # (フレーム番号, スロット番号)
+        self.held_slot = None  # 表示中のフレームのスロット
+        self.target = 0
+    
+    def send(self, *message):
+        self.requests.put(message)
+    
+    def start(self, start_frame, stride, every, target):
+        # start_frameは全体の時計、targetはこの動画のフレーム番号
+        self.stop()
+        self.generation += 1
+        self.active = True
+        self.eof = None
+        self.target = target
+        self.send('start', self.generation, start_frame, stride, every, target)
+    
+    def stop(self):
+        if self.active:
+            self.send('stop')
+            self.active = False
+        for _, slot in self.buffer:
+            self.send('free', slot)
+        self.buffer.clear()
+    
+    def _receive(self, timeout):
+        try:
+            if timeout > 0:
+                generation, frame_number, slot = self.results.get(timeout=timeout)
+            else:
+                generation, frame_number, slot = self.results.get_nowait()
+        except queue.Empty:
+            return False
+        if generation != self.generation or not self.active:
+            if slot is not None:
+                self.send('free', slot)  # 止めた先読みのフレーム
+        elif slot is None:
+            self.eof = frame_number
+        else:
+            self.buffer.append((frame_number, slot))
+        return True
+    
+    def get_frame(self, frame_number, timeout, stats):
+        # VideoPlayer.get_buffered_frameと同じ（返すのは共有メモリのスロットを参照する配列）
+        deadline = time.time() + timeout
+        while True:
+            while self._receive(0):
+                pass
+            # 表示済みの古いフレームのスロットは返す
+            while self.buffer and self.buffer[0][0] < frame_number:
+                self.send('free', self.buffer.popleft()[1])
+            
+            depth = len(self.buffer)
+            if self.buffer and self.buffer[0][0] == frame_number:
+                _, slot = self.buffer.popleft()
+                if self.held_slot is not None:
+                    self.send('free', self.held_slot)
+                self.held_slot = slot
+                stats['delivered'] += 1
+                stats['depth_sum'] += depth
+                if stats['min_depth'] is None or depth < stats['min_depth']:
+                    stats['min_depth'] = depth
+                return self.slots[slot]
+            
+            if self.eof is not None and frame_number >= self.eof:
+                return None
+            if not self.buffer and frame_number > self.target:
+                # 表示側に追い越されたのでワーカーに目標位置まで進ませる
+                self.target = frame_number
+                self.send('target', frame_number)
+            
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.active:
+                stats['underruns'] += 1
+                return None
+            self._receive(remaining)
+    
+    def close(self):
+        self.stop()
+        self.send('quit')
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.buffer.clear()
+        self.held_slot = None
+        self.slots = None
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # 表示中のフレームが参照している間は閉じられない（参照がなくなれば解放される）
+
+def run_decode_process(video_path, size, index, proxy_path, shm_name, slot_count, decoder_threads, roi,
+                       requests, results):
+    # ProcessDecoderのワーカープロセス。要求された番号のフレームを空いているスロットに書いて番号を送り返す
+    shm = shared_memory.SharedMemory(name=shm_name)
+    width, height = size
+    slots = np.ndarray((slot_count, height, width, 3), dtype=np.uint8, buffer=shm.buf)
+    player = VideoPlayer(video_path, (0, 0), size, index=index, proxy_path=proxy_path,
+                         decoder_threads=decoder_threads)
+    player.set_roi(roi)
+    free = deque(range(slot_count))
+    job = None  # [世代, 開始フレーム, 間隔, every, 次のステップ]
+    target = 0
+    last = -1
+    try:
+        while True:
+            # 先読みすることがなければ要求を待ち、あれば溜まっている要求を先に処理する
+            try:
+                message = requests.get() if job is None or not free else requests.get_nowait()
+            except queue.Empty:
+                message = None
+            if message is not None:
+                kind = message[0]
+                if kind == 'quit':
+                    break
+                if kind == 'free':
+                    free.append(message[1])
+                elif kind == 'start':
+                    job = list(message[1:5]) + [0]
+                    target = message[5]
+                    last = -1
+                elif kind == 'stop':
+                    job = None
+                elif kind == 'target':
+                    target = max(target, message[1])
+                elif kind == 'index':
+                    player.set_index(message[1])
+                elif kind == 'proxy':
+                    player.set_proxy(message[1])
+                elif kind == 'roi':
+                    player.set_roi(message[1])
+                elif kind == 'timeline':
+                    player.set_timeline(message[1])
+                continue
+            
+            generation, start, stride, every, step = job
+            frame_number = player.map_frame(stride_frame(start, step * every, stride))
+            # 表示側に追い越されていたら目標位置まで進め、前と同じフレームや開始前のフレームは読まない
+            need = max(target, last + 1, 0)
+            if frame_number < need:
+                step = first_step_reaching(player.timeline, need, start, stride, every)
+                frame_number = player.map_frame(stride_frame(start, step * every, stride))
+            job[4] = step + 1
+            last = frame_number
+            frame = player.get_frame(frame_number)
+            if frame is None:
+                results.put((generation, frame_number, None))
+                job = None
+                continue
+            slot = free.popleft()
+            slots[slot] = frame
+            results.put((generation, frame_number, slot))
+    finally:
+        player.release()
+        del slots
+        shm.close()
+
+def parse_layout(layout):
+    # "2x3" のようなレイアウト文字列を (行数, 列数) にする
+    rows, cols = map(int, layout.lower().split('x'))
+    if rows < 1 or cols < 1:
+        raise ValueError(f"不正なレイアウトです: {layout}")
+    return rows, cols
+
+def compute_tile_layout(layout, canvas_size, count, margin=2):
+    # 各タイルの位置とサイズ [((x, y), (w, h)), ...] を計算（マージンを考慮）
+    rows, cols = parse_layout(layout)
+    canvas_width, canvas_height = canvas_size
+    video_width = (canvas_width - margin * (cols - 1)) // cols
+    video_height = (canvas_height - margin * (rows - 1)) // rows
+    if video_width <= 0 or video_height <= 0:
+        raise ValueError(f"タイルが小さすぎるレイアウトです: {layout}")
+    
+    tiles = []
+    for i in range(min(count, rows * cols)):
+        row = i // cols
+        col = i % cols
+        x = col * (video_width + margin)
+        y = row * (video_height + margin)
+        tiles.append(((x, y), (video_width, video_height)))
+    return tiles
+
+def probe_timeline_source(video_path, index=None):
+    # build_timelineに渡す (フレーム数, fps, タイムスタンプ) を返す
+    # インデックスがあればその正確なフレーム数とタイムスタンプ、なければコンテナの値
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if index is not None:
+            return index.frame_count, fps, index.pts_ms
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), fps, None
+    finally:
+        cap.release()
+
+def export_frame_indices(max_frames, speed_multiplier):
+    # 出力動画の各フレームに対応する元動画のフレーム番号
+    # 高速再生ではフレームを飛ばし、低速再生では同じフレームを繰り返す（0.75倍速のような速度も正しく扱う）
+    total_output_frames = math.ceil(max_frames / speed_multiplier - 1e-9)
+    return [frame_num for frame_num in (stride_frame(0, i, speed_multiplier) for i in range(total_output_frames))
+            if frame_num < max_frames]
+
+def draw_export_label(combined_frame, filename, x, y, w, h):
+    # ファイル名を描画
+    text_x = x + w // 2
+    text_y = y + h - 10
+    
+    # テキストサイズを計算（動的にスケール調整）
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = min(w, h) / 400
+    font_scale = max(0.3, min(1.0, font_scale))
+    thickness = max(1, int(font_scale * 2))
+    text_size = cv2.getTextSize(filename, font, font_scale, thickness)[0]
+    
+    # テキストの背景を描画（可読性向上）
+    bg_x1 = text_x - text_size[0] // 2 - 5
+    bg_y1 = text_y - text_size[1] - 5
+    bg_x2 = text_x + text_size[0] // 2 + 5
+    bg_y2 = text_y + 5
+    cv2.rectangle(combined_frame, (bg_x1, bg_y1), (bg_x2, bg_y2), (0, 0, 0), -1)
+    
+    # テキストを描画
+    text_x_adjusted = text_x - text_size[0] // 2
+    cv2.putText(combined_frame, filename, (text_x_adjusted, text_y), 
+               font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
+    return (bg_x1, bg_y1, bg_x2, bg_y2)
+
+def render_label_overlay(filename, w, h):
+    # ファイル名ラベルを一度だけ描画し、タイル内の位置と画像を返す
+    # 背景の矩形は不透明なので、毎フレームこの領域をコピーするだけで合成できる
+    tile = np.zeros((h, w, 3), dtype=np.uint8)
+    x1, y1, x2, y2 = draw_export_label(tile, filename, 0, 0, w, h)
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(w, x2 + 1), min(h, y2 + 1)
+    return x1, y1, tile[y1:y2, x1:x2].copy()
+
+class ExportCancelled(Exception):
+    # 保存がキャンセルされた。書き終えた部分動画が残っていればresumableが真になり、
+    # 同じ設定で保存し直すと続きから再開できる（ffmpegがなく1回で書き出す場合は残らない）
+    resumable = False
+
+class ExportPipeline:
+    # 保存処理をデコード（タイルごとのスレッド）→合成→書き込み（専用スレッド）のパイプラインで行う
+    QUEUE_DEPTH = 8
+    _REPEAT = object()  # 直前と同じフレームをもう一度書き込む
+    
+    def __init__(self, tiles, canvas_size, frame_indices, writer, progress_callback=None,
+                 queue_depth=QUEUE_DEPTH, cancel_event=None, roi=None, tile_indices=None, indexes=None):
+        self.tiles = tiles  # [(動画パス, (x, y), (w, h)), ...]
+        self.canvas_size = canvas_size
+        self.frame_indices = frame_indices  # 出力フレームごとの元フレーム番号
+        # タイルごとの出力フレームに対応するフレーム番号（fpsや開始位置の違うタイル用。負なら開始前で黒）
+        # Noneなら全タイルでframe_indicesを使う
+        self.tile_indices = tile_indices or [frame_indices] * len(tiles)
+        self.writer = writer  # write(BGRフレーム)を持つオブジェクト
+        self.progress_callback = progress_callback
+        self.queue_depth = queue_depth
+        self.cancel_event = cancel_event  # セットされたら合成を止めてExportCancelledを送出する
+        self.roi = roi  # 全タイル共通の表示範囲（Noneならフレーム全体）
+        # タイルごとのキーフレームインデックス（呼び出し側で一度だけ用意する。Noneのタイルはインデックスなし）
+        self.indexes = indexes or [None] * len(tiles)
+        self._stop = threading.Event()
+        self.stats = {'frames': 0, 'decode_s': [0.0] * len(tiles), 'compose_s': 0.0,
+                      'write_s': 0.0, 'wall_s': 0.0}
+    
+    def run(self):
+        start = time.perf_counter()
+        # 保存用に元動画のデコーダを開く（BGRのまま出力させて色変換の往復をなくす）
+        players = [VideoPlayer(path, position, size, index=index, rgb=False)
+                   for (path, position, size), index in zip(self.tiles, self.indexes)]
+        for player in players:
+            player.set_roi(self.roi)
+        overlays = [render_label_overlay(os.path.basename(path), size[0], size[1])
+                    for path, _, size in self.tiles]
+        
+        tile_queues = [queue.Queue(maxsize=self.queue_depth) for _ in players]
+        write_queue = queue.Queue(maxsize=self.queue_depth)
+        # 出力バッファは使い回す（書き込みスレッドが使い終わったら戻す）
+        canvas_width, canvas_height = self.canvas_size
+        free_buffers = queue.Queue()
+        for _ in range(self.queue_depth + 2):
+            free_buffers.put(np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8))
+        
+        threads = [threading.Thread(target=self._decode_loop, args=(i, player, tile_queues[i]),
+                                    name=f"export decode {player.label}", daemon=True)
+                   for i, player in enumerate(players)]
+        writer_error = []
+        writer_thread = threading.Thread(target=self._write_loop, args=(write_queue, free_buffers, writer_error),
+                                         name="export write", daemon=True)
+        for thread in threads:
+            thread.start()
+        writer_thread.start()
+        
+        try:
+            self._compose_loop(players, overlays, tile_queues, write_queue, free_buffers)
+            self._put(write_queue, None)
+            writer_thread.join()
+            if writer_error:
+                raise writer_error[0]
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            writer_thread.join()  # 呼び出し側がライターを閉じる前に書き込みを終わらせる
+            for player in players:
+                player.release()
+        self.stats['wall_s'] = time.perf_counter() - start
+        return self.stats
+    
+    def _put(self, q, item):
+        # 他のステージが止まった場合に永久に待たないようにする
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise RuntimeError("保存処理が中断されました")
+    
+    def _decode_loop(self, tile_id, player, out_queue):
+        try:
+            # 同じフレームの繰り返しは1回だけ読み、飛ばすフレームはgrab()で読み飛ばす
+            indices = self.tile_indices[tile_id]
+            unique_indices = [frame_num for i, frame_num in enumerate(indices)
+                              if i == 0 or frame_num != indices[i - 1]]
+            # 開始前のフレームはデコードせずに黒にする（番号は単調増加なので先頭にだけある）
+            frames = itertools.chain(((frame_num, None) for frame_num in unique_indices if frame_num < 0),
+                                     player.iter_frames([frame_num for frame_num in unique_indices if frame_num >= 0]))
+            while True:
+                t0 = time.perf_counter()
+                item = next(frames, None)
+                self.stats['decode_s'][tile_id] += time.perf_counter() - t0
+                perf_tracer.counter('export tile queue', out_queue.qsize(), player.label)
+                if item is None:
+                    break
+                if not self._put(out_queue, item):
+                    return
+        except Exception as e:
+            self._put(out_queue, e)
+    
+    def _compose_loop(self, players, overlays, tile_queues, write_queue, free_buffers):
+        tile_frame_nums = [None] * len(players)
+        tile_frames = [None] * len(players)
+        for k in range(len(self.frame_indices)):
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                raise ExportCancelled("保存がキャンセルされました")
+            changed = False
+            for i in range(len(players)):
+                if tile_frame_nums[i] != self.tile_indices[i][k]:
+                    item = self._get(tile_queues[i])
+                    if isinstance(item, Exception):
+                        raise item
+                    tile_frame_nums[i], tile_frames[i] = item
+                    changed = True
+            
+            if not changed:
+                # どのタイルも変わっていなければ直前のフレームを再利用
+                self._put(write_queue, self._REPEAT)
+                continue
+            
+            t0 = time.perf_counter()
+            combined_frame = self._get(free_buffers)
+            for player, (label_x, label_y, label), frame in zip(players, overlays, tile_frames):
+                x, y = player.position
+                w, h = player.size
+                tile = combined_frame[y:y + h, x:x + w]
+                if frame is None:
+                    tile[:] = 0  # 開始前か動画が終わったタイルは黒
+                    continue
+                tile[:] = frame
+                # 事前に描画したラベルを重ねる
+                tile[label_y:label_y + label.shape[0], label_x:label_x + label.shape[1]] = label
+            self.stats['compose_s'] += time.perf_counter() - t0
+            perf_tracer.end('export compose', t0)
+            perf_tracer.counter('export write queue', write_queue.qsize())
+            self._put(write_queue, combined_frame)
+    
+    def _write_loop(self, write_queue, free_buffers, errors):
+        try:
+            last_frame = None
+            total = len(self.frame_indices)
+            while True:
+                item = self._get(write_queue)
+                if item is None:
+                    break
+                if item is not self._REPEAT:
+                    if last_frame is not None:
+                        free_buffers.put(last_frame)
+                    last_frame = item
+                t0 = time.perf_counter()
+                self.writer.write(last_frame)
+                self.stats['write_s'] += time.perf_counter() - t0
+                perf_tracer.end('export write', t0)
+                self.stats['frames'] += 1
+                if self.progress_callback and self.stats['frames'] % 10 == 0:
+                    self.progress_callback(self.stats['frames'], total)
+        except Exception as e:
+            errors.append(e)
+            self._stop.set()
+
+def format_export_stats(stats):
+    # ステージごとの処理時間を表示用の文字列にする
+    wall = stats['wall_s'] or 1e-9
+    decode = stats['decode_s']
+    return (f"保存: {stats['frames']}フレーム / {wall:.1f}秒 ({stats['frames'] / wall:.1f} fps) | "
+            f"デコード 合計{sum(decode):.1f}秒 最大{max(decode, default=0):.1f}秒/タイル | "
+            f"合成 {stats['compose_s']:.1f}秒 | 書き込み {stats['write_s']:.1f}秒")
+
+def find_ffmpeg():
+    return shutil.which('ffmpeg')
+
+# 保存時のエンコーダ設定の既定値（backend: auto / ffmpeg / opencv）
+DEFAULT_ENCODER_SETTINGS = {'backend': 'auto', 'codec': 'libx264', 'crf': 20, 'preset': 'veryfast', 'threads': 0}
+
+class FFmpegWriter:
+    # 合成したBGRフレームをパイプでffmpegに渡してエンコードする
+    def __init__(self, output_path, fps, size, codec='libx264', crf=20, preset='veryfast', threads=0,
+                 ffmpeg=None):
+        width, height = size
+        command = [
+            ffmpeg or find_ffmpeg(), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+            '-an', '-c:v', codec, '-crf', str(crf), '-preset', preset, '-threads', str(threads),
+            # yuv420pは幅と高さが偶数である必要があるので、奇数なら1ピクセル足す
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p',
+            output_path,
+        ]
+        self.output_path = output_path
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    
+    def write(self, frame):
+        # 連続したバッファならmemoryviewでコピーせずにそのまま渡す
+        if not frame.flags['C_CONTIGUOUS']:
+            frame = np.ascontiguousarray(frame)
+        self.process.stdin.write(memoryview(frame))
+    
     def release(self):
-        self.cap.release()
+        if self.process.stdin and not self.process.stdin.closed:
+            self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpegがエラー終了しました (code {returncode}): {self.output_path}")
+
+def open_video_writer(output_path, fps, size, encoder=None):
+    # 設定に応じてffmpegまたはOpenCVのライターを開く。(ライター, バックエンド名) を返す
+    settings = dict(DEFAULT_ENCODER_SETTINGS, **(encoder or {}))
+    backend = settings['backend']
+    if backend in ('auto', 'ffmpeg'):
+        ffmpeg = find_ffmpeg()
+        if ffmpeg:
+            writer = FFmpegWriter(output_path, fps, size, settings['codec'], settings['crf'],
+                                  settings['preset'], settings['threads'], ffmpeg)
+            return writer, f"ffmpeg/{settings['codec']}"
+        if backend == 'ffmpeg':
+            print("ffmpegが見つからないため、OpenCVのVideoWriterで保存します")
+    return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size), "opencv/mp4v"
+
+def join_video_segments(segment_paths, output_path):
+    # 分割して書き出した動画を再エンコードせずに1つに結合する（2つ以上ならffmpegが必要）
+    if len(segment_paths) == 1:
+        os.replace(segment_paths[0], output_path)
+        return
+    list_path = output_path + '.concat.txt'
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        subprocess.run([find_ffmpeg(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', list_path, '-c', 'copy', output_path], check=True)
+    finally:
+        os.remove(list_path)
+
+# 分割保存の1つの部分動画のフレーム数（30fpsで10秒）
+EXPORT_SEGMENT_FRAMES = 300
+
+def render_export_segment(job, progress_callback=None):
+    # 担当範囲のフレームを合成して部分動画に書き出す（ワーカープロセスでも実行する）
+    # 書き終わるまでは一時ファイルに書くので、途中で止まっても書きかけの部分動画は残らない
+    tmp_path = os.path.splitext(job['output_path'])[0] + '.tmp.mp4'
+    out, backend = open_video_writer(tmp_path, job['fps'], job['canvas_size'], job.get('encoder'))
+    progress_queue = job.get('progress_queue')
+    
+    def progress(done, total):
+        if progress_queue is not None:
+            progress_queue.put((job['segment_id'], done))
+        if progress_callback is not None:
+            progress_callback(done, total)
+    
+    try:
+        pipeline = ExportPipeline(job['tiles'], job['canvas_size'], job['frame_indices'], out, progress,
+                                  cancel_event=job.get('cancel_event'), roi=job.get('roi'),
+                                  tile_indices=job.get('tile_indices'), indexes=job.get('indexes'))
+        stats = pipeline.run()
+    except BaseException:
+        try:
+            out.release()
+        except Exception:
+            pass
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    out.release()
+    os.replace(tmp_path, job['output_path'])
+    progress(stats['frames'], len(job['frame_indices']))
+    stats['backend'] = backend
+    return stats
+
+def create_export_pool(workers):
+    # Tkを動かしているプロセスをforkしないようにspawnを使う
+    context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context), context.Manager()
+
+class ExportManifest:
+    # 分割保存で書き終えた部分動画の記録（保存ジョブの設定のキーと一緒に作業ディレクトリに保存する）
+    VERSION = 1
+    
+    def __init__(self, work_dir, key):
+        self.path = os.path.join(work_dir, 'manifest.json')
+        self.key = key
+        self.completed = {}  # 部分動画の番号 -> フレーム数
+    
+    @classmethod
+    def load(cls, work_dir, key):
+        # 同じ設定の保存ジョブの記録がなければNone
+        manifest = cls(work_dir, key)
+        try:
+            with open(manifest.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] != cls.VERSION or data['key'] != key:
+                return None
+            manifest.completed = {int(segment_id): int(frames) for segment_id, frames in data['completed'].items()}
+        except (OSError, KeyError, ValueError, TypeError, AttributeError):
+            return None
+        return manifest
+    
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'key': self.key,
+                       'completed': {str(segment_id): frames for segment_id, frames in self.completed.items()}}, f)
+        os.replace(tmp_path, self.path)
+    
+    def is_done(self, segment_id, segment_path, frames):
+        return self.completed.get(segment_id) == frames and os.path.exists(segment_path)
+    
+    def mark_done(self, segment_id, frames):
+        self.completed[segment_id] = frames
+        self.save()
+
+def export_work_dir(output_path):
+    # 部分動画と記録を置く作業ディレクトリ（出力先と同じ場所）
+    output_path = os.path.abspath(output_path)
+    return os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}.parts")
+
+def export_job_key(tiles, canvas_size, frame_indices, fps, encoder, segment_frames, roi=None, tile_indices=None):
+    # 入力ファイル（サイズと更新日時）、配置、タイムライン、エンコード設定が同じなら同じキーになる
+    settings = dict(DEFAULT_ENCODER_SETTINGS, **(encoder or {}))
+    # 部分動画ごとにエンコーダが変わると結合できないので、実際に使うバックエンドを含める
+    settings['backend'] = 'ffmpeg' if settings['backend'] in ('auto', 'ffmpeg') and find_ffmpeg() else 'opencv'
+    job = {
+        'tiles': [[os.path.abspath(path), list(position), list(size), list(file_signature(path))]
+                  for path, position, size in tiles],
+        'canvas_size': list(canvas_size),
+        'frames': hashlib.sha1(np.asarray(frame_indices, dtype=np.int64).tobytes()).hexdigest(),
+        'fps': fps,
+        'encoder': settings,
+        'segment_frames': segment_frames,
+        'roi': list(roi) if roi is not None else None,
+        'tile_frames': hashlib.sha1(np.asarray(tile_indices, dtype=np.int64).tobytes()).hexdigest()
+                       if tile_indices is not None else None,
+    }
+    return hashlib.sha1(json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()
+
+def render_segments_parallel(jobs, workers, progress_callback=None, executor=None, manager=None,
+                             cancel_event=None, segment_callback=None):
+    # 部分動画を別プロセスで並列に書き出す。書き終えた順にsegment_callback(job)を呼ぶ
+    own_pool = executor is None
+    if own_pool:
+        executor, manager = create_export_pool(min(workers, len(jobs)))
+    try:
+        progress_queue = manager.Queue()
+        # 呼び出し側のthreading.Eventはワーカープロセスから見えないので共有のEventに中継する
+        shared_cancel = manager.Event()
+        futures = {}
+        for job in jobs:
+            job = dict(job, progress_queue=progress_queue, cancel_event=shared_cancel)
+            futures[executor.submit(render_export_segment, job)] = job
+        
+        segment_done = {}
+        stats_list = []
+        
+        def collect(finished):
+            for future in finished:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                job = futures[future]
+                stats_list.append(future.result())
+                segment_done[job['segment_id']] = len(job['frame_indices'])
+                if segment_callback:
+                    segment_callback(job)
+        
+        pending = set(futures)
+        try:
+            while pending:
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    shared_cancel.set()
+                # 全ワーカーの進捗を集計する
+                while not progress_queue.empty():
+                    segment_id, done = progress_queue.get()
+                    segment_done[segment_id] = done
+                collect(finished)
+                for future in finished:
+                    if not future.cancelled() and future.exception() is not None:
+                        raise future.exception()  # ワーカーで発生した例外
+                if progress_callback:
+                    progress_callback(sum(segment_done.values()))
+        except BaseException:
+            # 残りの部分動画は止め、その間に書き終わったものは記録する
+            shared_cancel.set()
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            collect(pending)
+            raise
+        return stats_list
+    finally:
+        if own_pool:
+            executor.shutdown()
+            manager.shutdown()
+
+def merge_export_stats(stats_list, tile_count):
+    # 部分動画ごとの統計を1つにまとめる
+    merged = {'frames': 0, 'decode_s': [0.0] * tile_count, 'compose_s': 0.0, 'write_s': 0.0, 'wall_s': 0.0}
+    for stats in stats_list:
+        merged['frames'] += stats['frames']
+        merged['decode_s'] = [a + b for a, b in zip(merged['decode_s'], stats['decode_s'])]
+        merged['compose_s'] += stats['compose_s']
+        merged['write_s'] += stats['write_s']
+    merged['backend'] = stats_list[0]['backend'] if stats_list else '-'
+    return merged
+
+def render_comparison(tiles, canvas_size, frame_indices, output_path, fps=30, workers=1,
+                      progress_callback=None, executor=None, manager=None, encoder=None,
+                      cancel_event=None, segment_frames=EXPORT_SEGMENT_FRAMES, roi=None, timelines=None,
+                      indexes=None):
+    # 比較動画を一定フレーム数ごとの部分動画に分けて書き出し、最後に結合する（workersが2以上ならプロセス並列）
+    # 書き終えた部分動画は記録しておき、中断しても同じ設定で保存し直すと残りだけを書き出す
+    # timelinesはタイルごとのbuild_timelineの対応表（frame_indicesは全体の時計のフレーム番号になる）
+    # indexesはタイルごとのキーフレームインデックス（Noneの分はここで一度だけ読み込み、部分動画ごとには作らない）
+    start = time.perf_counter()
+    total = len(frame_indices)
+    if find_ffmpeg() is None:
+        # ffmpegがないと部分動画の結合が再エンコードになり、画質も速度も落ちるので1回で書き出す
+        # （この場合は並列保存と中断からの再開はできない）
+        if workers > 1:
+            print("ffmpegが見つからないため、並列にせずに1回で保存します")
+        segment_frames = max(1, total)
+        workers = 1
+    indexes = list(indexes or [None] * len(tiles))
+    indexes = [index if index is not None else VideoIndex.load_or_build(path)
+               for (path, _, _), index in zip(tiles, indexes)]
+    tile_indices = None
+    if timelines is not None:
+        tile_indices = [np.asarray(frame_indices) if timeline is None else np.asarray(timeline)[frame_indices]
+                        for timeline in timelines]
+        tile_indices = [indices.tolist() for indices in tile_indices]
+    work_dir = export_work_dir(output_path)
+    key = export_job_key(tiles, canvas_size, frame_indices, fps, encoder, segment_frames, roi, tile_indices)
+    manifest = ExportManifest.load(work_dir, key)
+    if manifest is None:
+        # 設定が変わっていれば以前の部分動画は使えない
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        manifest = ExportManifest(work_dir, key)
+    
+    segment_paths = []
+    jobs = []
+    for segment_id, begin in enumerate(range(0, total, segment_frames)):
+        segment_path = os.path.join(work_dir, f"part_{segment_id:04d}.mp4")
+        segment_paths.append(segment_path)
+        indices = frame_indices[begin:begin + segment_frames]
+        if manifest.is_done(segment_id, segment_path, len(indices)):
+            continue
+        jobs.append({
+            'segment_id': segment_id,
+            'tiles': tiles,
+            'canvas_size': canvas_size,
+            'fps': fps,
+            'frame_indices': indices,
+            'output_path': segment_path,
+            'encoder': encoder,
+            'roi': roi,
+            'indexes': indexes,
+            'tile_indices': [indices[begin:begin + segment_frames] for indices in tile_indices]
+                            if tile_indices is not None else None,
+        })
+    resumed = total - sum(len(job['frame_indices']) for job in jobs)
+    if resumed:
+        print(f"書き出し済みの部分動画を再利用します: {len(segment_paths) - len(jobs)}/{len(segment_paths)}個 "
+              f"({resumed}フレーム)")
+    
+    def segment_done(job):
+        manifest.mark_done(job['segment_id'], len(job['frame_indices']))
+    
+    try:
+        if workers > 1 and len(jobs) > 1:
+            stats_list = render_segments_parallel(
+                jobs, workers, progress_callback and (lambda done: progress_callback(resumed + done, total)),
+                executor, manager, cancel_event, segment_done)
+        else:
+            stats_list = []
+            finished = resumed
+            for job in jobs:
+                job['cancel_event'] = cancel_event
+                progress = progress_callback and (lambda done, _, base=finished: progress_callback(base + done, total))
+                stats_list.append(render_export_segment(job, progress))
+                segment_done(job)
+                finished += len(job['frame_indices'])
+    except ExportCancelled as e:
+        e.resumable = bool(manifest.completed)
+        raise
+    
+    join_video_segments(segment_paths, output_path)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    
+    stats = merge_export_stats(stats_list, len(tiles))
+    stats['wall_s'] = time.perf_counter() - start
+    stats['resumed_frames'] = resumed
+    return [stats]
+
+def format_export_summary(output_path, stats_list):
+    # バックエンドごとのスループットとファイルサイズ（ジョブごとに選べるように表示する）
+    frames = sum(stats['frames'] for stats in stats_list)
+    wall = max((stats['wall_s'] for stats in stats_list), default=0) or 1e-9
+    backend = stats_list[0].get('backend', '?') if stats_list else '?'
+    size_mb = os.path.getsize(output_path) / 1024 / 1024 if os.path.exists(output_path) else 0
+    return f"エンコーダ {backend}: {frames / wall:.1f} fps / {size_mb:.1f}MB ({output_path})"
+
+def export_comparison(inputs, output_path, layout="2x2", canvas_size=(1920, 1080), speed=1.0,
+                      workers=1, progress_callback=None, executor=None, manager=None, encoder=None, roi=None,
+                      offsets=None):
+    # GUIなしで比較動画を作成する（レイアウトの形式はGUIと同じ）
+    # fpsの違う動画も時刻で揃え、最も高いfpsで書き出す。offsetsはタイルごとの開始の遅れ（秒）
+    tile_layout = compute_tile_layout(layout, canvas_size, len(inputs))
+    tiles = [(path, position, size) for path, (position, size) in zip(inputs, tile_layout)]
+    indexes = [VideoIndex.load_or_build(path) for path, _, _ in tiles]
+    fps, timelines = build_timeline([probe_timeline_source(path, index)
+                                     for (path, _, _), index in zip(tiles, indexes)], offsets)
+    max_frames = len(timelines[0]) if timelines else 0
+    frame_indices = export_frame_indices(max_frames, speed)
+    if not frame_indices:
+        raise ValueError("書き出すフレームがありません")
+    return render_comparison(tiles, canvas_size, frame_indices, output_path, fps, workers,
+                             progress_callback, executor, manager, encoder, roi=roi, timelines=timelines,
+                             indexes=indexes)
 
 class VideoComparisonApp:
     def __init__(self, root):
         self.root = root
         self.root.title("動画比較ビューア")
-        self.root.state('zoomed')  # Windowsで最大化
-        # self.root.attributes('-zoomed', True)  # Linuxの場合はこちらを使用
+        try:
+            self.root.state('zoomed')  # Windowsで最大化
+        except tk.TclError:
+            self.root.attributes('-zoomed', True)  # Linuxの場合はこちらを使用
         
         self.videos = []
-        self.video_players = []
+        self.video_players = []  # 現在表示中のタイルのプレイヤー
+        self.player_pool = {}  # 動画リストの番号 -> VideoPlayer（レイアウト変更をまたいで再利用）
+        self._resize_after_id = None
+        self._layout_canvas_size = None
+        # 表示用の合成バッファ（update_layoutで作成）
+        self.display_buffer = None
+        self.display_image = None
+        self.display_photo = None
+        self.tile_frames = []
         self.is_playing = False
-        self.current_frame = 0
+        self.current_frame = 0  # 全タイル共通の時計のフレーム番号（タイルごとの番号はVideoPlayer.map_frameで求める）
         self.max_frames = 0
+        # 全体の時計のfps（タイルの最も高いfps）と、タイルごとの開始のずれ（動画リストの番号 -> 秒）
+        self.timeline_fps = 30.0
+        self.tile_offsets = {}
+        # 再生時にタイルごとに先読みするフレーム数
+        self.prefetch_depth = VideoPlayer.PREFETCH_DEPTH
+        # スライダーが止まってから正確なフレームに差し替えるまでの時間（ミリ秒）
+        self.scrub_settle_ms = 150
+        self._scrub_after_id = None
+        # フレームに使うメモリ全体の上限（MB）。先読みバッファとスクラブ用のフレームキャッシュで分け合う
+        self.frame_memory_budget_mb = FrameCache.DEFAULT_BUDGET_MB
+        self.frame_cache = FrameCache(self.frame_memory_budget_mb)
+        # 全タイルで共有するデコードワーカー（タイル数が増えてもスレッド数は増やさない）
+        self.decode_pool = DecodePool(max(2, min(8, os.cpu_count() or 1)))
+        # 表示しなくなった動画のデコーダを開いたままにしておく数
+        self.max_idle_decoders = 4
+        # これより多いタイルを再生するときは、マウスが乗っているタイル以外の更新頻度を下げる
+        self.full_rate_tiles = 9
+        self.focus_tile = None
+        self.off_focus_every = 1
+        # 全タイル共通の表示範囲（ズーム・パン。Noneならフレーム全体）
+        self.roi = None
+        self.max_zoom = 32
+        self._pan_start = None
+        # 動画パスごとのキーフレームインデックス（バックグラウンドで作成）
+        self.video_indexes = {}
+        self._index_generation = 0
+        # 読み込み中の動画（リストの番号 -> VideoProbe、開けなかった動画の番号）
+        self.video_probes = {}
+        self._load_generation = 0
+        self._load_pending = 0
+        self._load_failed = set()
+        self._open_pending = set()  # デコーダを開いている途中の動画の番号
+        # 表示用プロキシ動画（動画パス -> プロキシのパス）
+        self.proxy_cache = ProxyCache()
+        self.proxy_paths = {}
+        self._proxy_cancel = None
+        # タイムラインのサムネイル（動画パス -> ThumbnailStore、バックグラウンドで作成）
+        self.thumbnail_stores = {}
+        self._thumbnail_cancel = None
+        self.filmstrip_photo = None
+        self.preview_window = None
+        self.preview_photo = None
+        # 基準動画との差分解析の結果（動画パス -> DiffMetrics）と差分タイル
+        self.diff_reference = None
+        self.diff_results = {}
+        self._diff_cancel = None
+        self.heatmap_photo = None
+        self.diff_tile = None  # 差分タイルの ((x, y), (w, h))
+        self.diff_pair = None  # 差分タイルで比較するタイル番号 (基準, 比較)
+        self.tile_images = []  # タイルごとに最後に合成したフレーム（差分タイル用）
+        # 再生スケジューラの状態
+        self._play_after_id = None
+        self._play_start_time = 0.0
+        self._play_start_frame = 0
+        self._play_tick_rate = 30.0
+        self._play_stride = 1.0
+        self._play_last_tick = 0
+        self._shown_times = deque()
+        self.play_stats = {'shown': 0, 'dropped': 0}
+        # 保存時のエンコーダ設定（コーデック・CRF・プリセット・スレッド数）
+        self.encoder_settings = dict(DEFAULT_ENCODER_SETTINGS)
+        # HUDの最終更新時刻（更新は1秒に数回に抑える）
+        self._hud_updated_at = 0.0
         
         self.setup_ui()
         self.setup_drag_drop()
@@ -74,11 +2215,14 @@ class VideoComparisonApp:
         # レイアウト設定
         ttk.Label(control_frame, text="レイアウト:").pack(side=tk.LEFT, padx=(10, 5))
         self.layout_var = tk.StringVar(value="2x2")
+        # 一覧にないレイアウト（例: 6x4）も入力してEnterで適用できる
         layout_combo = ttk.Combobox(control_frame, textvariable=self.layout_var,
-                                   values=["1x1", "1x2", "1x3", "2x1", "2x2", "2x3", "3x1", "3x2", "3x3"],
-                                   width=10, state="readonly")
+                                   values=["1x1", "1x2", "1x3", "2x1", "2x2", "2x3", "3x1", "3x2", "3x3",
+                                           "3x4", "4x4", "4x5", "5x5"],
+                                   width=10)
         layout_combo.pack(side=tk.LEFT, padx=(0, 10))
         layout_combo.bind("<<ComboboxSelected>>", self.update_layout)
+        layout_combo.bind("<Return>", self.update_layout)
         
         # 再生コントロール
         ttk.Button(control_frame, text="再生/停止", 
@@ -91,11 +2235,74 @@ class VideoComparisonApp:
                                   values=[0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0, 4.0],
                                   width=8, state="readonly")
         speed_combo.pack(side=tk.LEFT, padx=(0, 10))
+        speed_combo.bind("<<ComboboxSelected>>", self.on_speed_change)
+        
+        # プロキシモード（重い動画を低解像度のプロキシで表示）
+        self.proxy_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="プロキシ", variable=self.proxy_var,
+                        command=self.on_proxy_toggle).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # 再生時のデコードを動画ごとの別プロセスで行う（4Kを多数並べるとUIプロセスのCPUが足りなくなる場合）
+        self.process_decode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="別プロセスでデコード", variable=self.process_decode_var,
+                        command=self.on_process_decode_toggle).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # 処理時間のオーバーレイ表示とトレースの記録（カクつきの原因調査用）
+        self.hud_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="HUD", variable=self.hud_var,
+                        command=self.on_hud_toggle).pack(side=tk.LEFT, padx=(0, 5))
+        self.trace_button = ttk.Button(control_frame, text="トレース保存" if perf_tracer.tracing else "トレース開始",
+                                       command=self.toggle_trace)
+        self.trace_button.pack(side=tk.LEFT, padx=(0, 10))
+        
+        # 差分解析（基準動画と各動画のフレームごとの差をタイムラインに表示）
+        ttk.Label(control_frame, text="基準:").pack(side=tk.LEFT, padx=(5, 2))
+        self.reference_var = tk.StringVar(value="")
+        self.reference_combo = ttk.Combobox(control_frame, textvariable=self.reference_var, values=[],
+                                            width=12, state="readonly")
+        self.reference_combo.pack(side=tk.LEFT, padx=(0, 5))
+        self.reference_combo.bind("<<ComboboxSelected>>", lambda event: self.on_reference_change())
+        self.ssim_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="SSIM", variable=self.ssim_var).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(control_frame, text="差分解析", command=self.start_diff_analysis).pack(side=tk.LEFT, padx=(0, 5))
+        self.diff_tile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="差分タイル", variable=self.diff_tile_var,
+                        command=self.update_layout).pack(side=tk.LEFT, padx=(0, 10))
         
         # 保存ボタン
         ttk.Button(control_frame, text="動画保存", 
                   command=self.save_video).pack(side=tk.LEFT, padx=(10, 5))
         
+        # 保存時の並列プロセス数（1なら従来どおり1スレッドで保存）
+        ttk.Label(control_frame, text="並列:").pack(side=tk.LEFT, padx=(5, 2))
+        # 分割した動画の結合にffmpegを使うので、ffmpegがなければ1に固定する
+        self.export_workers_var = tk.IntVar(value=1)
+        ttk.Spinbox(control_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.export_workers_var,
+                    width=3, state="readonly" if find_ffmpeg() else "disabled").pack(side=tk.LEFT, padx=(0, 10))
+        
+        # 保存時のエンコーダ（autoならffmpegがあればffmpeg、なければOpenCV）
+        ttk.Label(control_frame, text="エンコーダ:").pack(side=tk.LEFT, padx=(5, 2))
+        self.encoder_var = tk.StringVar(value=self.encoder_settings['backend'])
+        ttk.Combobox(control_frame, textvariable=self.encoder_var, values=["auto", "ffmpeg", "opencv"],
+                     width=7, state="readonly").pack(side=tk.LEFT, padx=(0, 5))
+        # ffmpegのコーデック・CRF・プリセット・スレッド数（OpenCVで保存する場合は使わない）
+        self.codec_var = tk.StringVar(value=self.encoder_settings['codec'])
+        ttk.Combobox(control_frame, textvariable=self.codec_var, values=["libx264", "libx265"],
+                     width=8, state="readonly").pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(control_frame, text="CRF:").pack(side=tk.LEFT, padx=(0, 2))
+        self.crf_var = tk.IntVar(value=self.encoder_settings['crf'])
+        ttk.Spinbox(control_frame, from_=0, to=51, textvariable=self.crf_var,
+                    width=3, state="readonly").pack(side=tk.LEFT, padx=(0, 5))
+        self.preset_var = tk.StringVar(value=self.encoder_settings['preset'])
+        ttk.Combobox(control_frame, textvariable=self.preset_var,
+                     values=["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower",
+                             "veryslow"],
+                     width=9, state="readonly").pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(control_frame, text="スレッド:").pack(side=tk.LEFT, padx=(0, 2))
+        self.encoder_threads_var = tk.IntVar(value=self.encoder_settings['threads'])
+        ttk.Spinbox(control_frame, from_=0, to=os.cpu_count() or 1, textvariable=self.encoder_threads_var,
+                    width=3, state="readonly").pack(side=tk.LEFT, padx=(0, 10))
+        
         # フレームスライダー
         self.frame_var = tk.IntVar()
         self.frame_scale = ttk.Scale(control_frame, from_=0, to=100, 
@@ -107,17 +2314,44 @@ class VideoComparisonApp:
         self.frame_label = ttk.Label(control_frame, text="Frame: 0/0")
         self.frame_label.pack(side=tk.LEFT, padx=(10, 5))
         
+        # 実効fpsとドロップしたフレーム数の表示
+        self.playback_label = ttk.Label(control_frame, text="0 fps / ドロップ 0")
+        self.playback_label.pack(side=tk.LEFT, padx=(5, 5))
+        
         # キーボード操作説明
         help_label = ttk.Label(control_frame, text="[左右←→キー: フレーム送り | Spaceキー: 再生/停止]", 
                               font=("Arial", 8), foreground="black", background="white")
         help_label.pack(side=tk.LEFT, padx=(5, 0))
         
+        # バックグラウンド処理の状態表示ラベル
+        self.status_label = ttk.Label(control_frame, text="")
+        self.status_label.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # タイムラインのサムネイル（ホバーで全タイルのプレビュー、クリックでその位置へ移動）
+        self.filmstrip = tk.Canvas(main_frame, height=ThumbnailStore.HEIGHT + 4, bg="gray15", highlightthickness=0)
+        self.filmstrip.pack(fill=tk.X, pady=(0, 5))
+        self.filmstrip.bind('<Configure>', lambda event: self.redraw_filmstrip())
+        self.filmstrip.bind('<Motion>', self.on_filmstrip_hover)
+        self.filmstrip.bind('<Leave>', lambda event: self.hide_thumbnail_preview())
+        self.filmstrip.bind('<Button-1>', self.on_filmstrip_click)
+        self.filmstrip.bind('<B1-Motion>', self.on_filmstrip_click)
+        
+        # 差分のヒートマップ（基準以外の動画ごとに1行、タイムラインと同じ位置関係）
+        self.heatmap = tk.Canvas(main_frame, height=0, bg="gray15", highlightthickness=0)
+        self.heatmap.pack(fill=tk.X, pady=(0, 5))
+        self.heatmap.bind('<Configure>', lambda event: self.redraw_heatmap())
+        self.heatmap.bind('<Motion>', self.on_heatmap_hover)
+        self.heatmap.bind('<Button-1>', self.on_filmstrip_click)
+        self.heatmap.bind('<B1-Motion>', self.on_filmstrip_click)
+        
         # 動画表示エリア
         self.canvas_frame = ttk.Frame(main_frame)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True)
         
         self.canvas = tk.Canvas(self.canvas_frame, bg="black")
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Motion>', self.on_canvas_motion)
+        self.canvas.bind('<Leave>', lambda event: self.set_focus_tile(None))
         
         # ドラッグ&ドロップ用のラベル
         self.drop_label = ttk.Label(self.canvas, 
@@ -129,23 +2363,101 @@ class VideoComparisonApp:
         self.progress_frame = None
         self.progress_bar = None
         self.progress_label = None
+        self.cancel_button = None
+        self._export_cancel = None
         
     def setup_keyboard_bindings(self):
         # キーボードイベントをバインド（フォーカスを確保するため）
         self.root.bind('<Key>', self.on_key_press)
         self.root.focus_set()  # ルートウィンドウにフォーカスを設定
         
-        # キャンバスクリック時にもフォーカスを設定
-        self.canvas.bind('<Button-1>', lambda e: self.root.focus_set())
+        # キャンバスクリック時にもフォーカスを設定（ドラッグでズーム中の表示範囲を移動）
+        self.canvas.bind('<Button-1>', self.on_canvas_press)
+        self.canvas.bind('<B1-Motion>', self.on_canvas_drag)
+        self.canvas.bind('<ButtonRelease-1>', lambda e: setattr(self, '_pan_start', None))
+        self.canvas.bind('<Double-Button-1>', lambda e: self.set_roi(None))
+        # マウスホイールでズーム（LinuxではButton-4/5）
+        self.canvas.bind('<MouseWheel>', self.on_canvas_wheel)
+        self.canvas.bind('<Button-4>', self.on_canvas_wheel)
+        self.canvas.bind('<Button-5>', self.on_canvas_wheel)
+        # マウスが乗っているタイルの開始位置を1フレーム（Shiftで10フレーム）ずらす
+        self.root.bind('<comma>', lambda e: self.shift_tile_offset(-1))
+        self.root.bind('<period>', lambda e: self.shift_tile_offset(1))
+        self.root.bind('<less>', lambda e: self.shift_tile_offset(-10))
+        self.root.bind('<greater>', lambda e: self.shift_tile_offset(10))
     
     def setup_drag_drop(self):
         # ドラッグ&ドロップの設定
-        self.canvas.drop_target_register(DND_FILES)
+        self.canvas.drop_target_register(tkinterdnd2.DND_FILES)
         self.canvas.dnd_bind('<<Drop>>', self.on_drop)
     
+    def on_canvas_press(self, event):
+        self.root.focus_set()
+        i = self.tile_at(event.x, event.y)
+        if self.roi is None or i is None:
+            self._pan_start = None
+        else:
+            self._pan_start = (event.x, event.y, self.roi, self.video_players[i].size)
+    
+    def on_canvas_drag(self, event):
+        if self._pan_start is None:
+            return
+        # ドラッグした分だけ表示範囲を逆向きに動かす（画像がマウスに付いてくる）
+        x0, y0, (rx, ry, rw, rh), (w, h) = self._pan_start
+        self.set_roi(self.clamp_roi((rx - (event.x - x0) / w * rw, ry - (event.y - y0) / h * rh, rw, rh)))
+    
+    def on_canvas_wheel(self, event):
+        zoom_in = event.num == 4 if event.num in (4, 5) else event.delta > 0
+        self.zoom_at(event.x, event.y, 1.25 if zoom_in else 1 / 1.25)
+    
+    def zoom_at(self, x, y, factor):
+        # カーソルの下の位置が動かないように全タイルの表示範囲を拡大・縮小する
+        i = self.tile_at(x, y)
+        if i is None:
+            return
+        player = self.video_players[i]
+        u = (x - player.position[0]) / player.size[0]
+        v = (y - player.position[1]) / player.size[1]
+        rx, ry, rw, rh = self.roi or (0.0, 0.0, 1.0, 1.0)
+        new_w = min(1.0, max(1.0 / self.max_zoom, rw / factor))
+        new_h = min(1.0, max(1.0 / self.max_zoom, rh / factor))
+        if new_w >= 1.0 and new_h >= 1.0:
+            self.set_roi(None)
+            return
+        self.set_roi(self.clamp_roi((rx + u * rw - u * new_w, ry + v * rh - v * new_h, new_w, new_h)))
+    
+    @staticmethod
+    def clamp_roi(roi):
+        x, y, w, h = roi
+        return (min(max(0.0, x), 1.0 - w), min(max(0.0, y), 1.0 - h), w, h)
+    
+    def set_roi(self, roi):
+        if roi == self.roi:
+            return
+        self.roi = roi
+        for player in self.player_pool.values():
+            player.set_roi(roi)
+        # 表示中のフレームは古い範囲なので、現在位置を新しい範囲で読み直す
+        self.tile_frames = [None] * len(self.video_players)
+        if self.is_playing:
+            self.restart_prefetch_if_playing()
+        else:
+            for player in self.video_players:
+                frame_number = player.map_frame(self.current_frame)
+                if frame_number >= 0:
+                    player.request_scrub(frame_number, False, self.on_scrub_frame)
+        self.status_label.config(text=f"ズーム {1 / roi[2]:.1f}x（ダブルクリックで元に戻す）" if roi else "")
+    
+    @staticmethod
+    def is_text_entry(widget):
+        # 入力欄（編集できるコンボボックスを含む）へのキー入力か
+        return isinstance(widget, tk.Entry) and str(widget.cget('state')) != 'readonly'
+    
     def on_key_press(self, event):
         if not self.video_players or self.max_frames == 0:
             return
+        if self.is_text_entry(event.widget):
+            return  # レイアウトの入力中は左右キーでフレームを動かさない
         
         key = event.keysym
         
@@ -155,6 +2467,7 @@ class VideoComparisonApp:
             self.current_frame = new_frame
             self.frame_var.set(new_frame)
             self.update_frame_display()
+            self.restart_prefetch_if_playing()
             
         elif key == 'Right':
             # 右キー：1フレーム進む
@@ -171,8 +2484,17 @@ class VideoComparisonApp:
     def on_window_resize(self, event):
         # ウィンドウサイズが変更された時の処理
         if event.widget == self.root and self.video_players:
-            # 少し遅延させてレイアウトを更新（連続的なリサイズイベントを避けるため）
-            self.root.after(100, self.update_layout)
+            # 連続的なリサイズイベントはまとめて、最後の1回だけレイアウトを更新する
+            if self._resize_after_id is not None:
+                self.root.after_cancel(self._resize_after_id)
+            self._resize_after_id = self.root.after(150, self.on_resize_settled)
+    
+    def on_resize_settled(self):
+        self._resize_after_id = None
+        self.canvas.update_idletasks()
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if canvas_size != self._layout_canvas_size:
+            self.update_layout()
         
     def on_drop(self, event):
         files = self.root.tk.splitlist(event.data)
@@ -192,25 +2514,586 @@ class VideoComparisonApp:
             self.load_videos(files)
     
     def load_videos(self, video_paths):
+        if self.is_playing:
+            self.stop_playback()
         # 既存の動画プレイヤーをクリーンアップ
-        for player in self.video_players:
+        for player in self.player_pool.values():
             player.release()
+        self.player_pool.clear()
         self.video_players.clear()
         
-        self.videos = video_paths
+        self.videos = list(video_paths)
         self.drop_label.place_forget()  # ドロップラベルを非表示
+        if self._thumbnail_cancel is not None:
+            self._thumbnail_cancel.set()
+        if self._diff_cancel is not None:
+            self._diff_cancel.set()
+        self.diff_results = {}
+        self.diff_reference = None
+        self.redraw_heatmap()
+        self.update_reference_choices()
+        self.max_frames = 0
+        self.frame_scale.configure(to=0)
+        self.roi = None
+        self.tile_offsets = {}
+        
+        # ファイルを開くのに時間がかかることがあるので（ネットワークドライブなど）、
+        # UIスレッドを止めずに全ファイルを並列に開き、全動画の情報が揃うまでは枠と進み具合だけを表示する
+        # （情報がキャッシュにあればデコーダが開くのを待たずにタイルを並べ、開いたタイルから表示する）
+        self._load_generation += 1
+        generation = self._load_generation
+        self._load_pending = len(self.videos)
+        self._load_failed = set()
+        self._open_pending = set(range(len(self.videos)))
+        self.video_probes = {}
+        if not self.videos:
+            return
+        self.draw_placeholders()
+        self.status_label.config(text=f"動画を読み込み中... (0/{len(self.videos)})")
+        decoder_threads = max(1, (os.cpu_count() or 1) // len(self.videos))
+        # 待ち時間のほとんどはI/OなのでCPU数より多く並列に開く
+        executor = ThreadPoolExecutor(max_workers=min(8, len(self.videos)))
+        for i, video_path in enumerate(self.videos):
+            executor.submit(self.open_video, generation, i, video_path, decoder_threads)
+        executor.shutdown(wait=False)
+    
+    def update_reference_choices(self):
+        self.reference_combo.configure(values=[f"{i + 1}: {os.path.basename(path)}"
+                                               for i, path in enumerate(self.videos)])
+        self.reference_var.set(f"1: {os.path.basename(self.videos[0])}" if self.videos else "")
+    
+    def open_video(self, generation, i, video_path, decoder_threads):
+        # 読み込みワーカーで実行する。キャッシュに動画情報があればデコーダを開く前にプレイヤーを渡す
+        player = None
+        passed = False  # プレイヤーをUIスレッドに渡したか（渡した後の解放はUIスレッドで行う）
+        opened = False
+        try:
+            probe_path = VideoProbe.cache_path(video_path)
+            signature = file_signature(video_path)
+            info = VideoProbe.load(probe_path, signature)
+            # 位置とサイズはupdate_layoutで設定する
+            player = VideoPlayer(video_path, (0, 0), (1, 1), self.frame_cache, self.video_indexes.get(video_path),
+                                 decode_pool=self.decode_pool, decoder_threads=decoder_threads, probe=info)
+            if info is not None:
+                self.root.after(0, lambda: self.on_video_probed(generation, i, info, player))
+                passed = True
+                if not player.open_decoder():
+                    raise IOError("デコーダを開けません")
+            else:
+                if not player.cap.isOpened():
+                    raise IOError("デコーダを開けません")
+                info = VideoProbe.from_capture(player.cap)
+                info.save(probe_path, signature)
+                self.root.after(0, lambda: self.on_video_probed(generation, i, info, player))
+                passed = True
+            # プロキシに切り替えるのは元動画の情報を読んでから
+            player.set_proxy(self.proxy_paths.get(video_path))
+            opened = True
+        except Exception as e:
+            print(f"動画を開けませんでした ({video_path}): {e}")
+            if player is not None and not passed:
+                player.release()
+        self.root.after(0, lambda: self.on_video_opened(generation, i, opened))
+    
+    def on_video_probed(self, generation, i, info, player):
+        if generation != self._load_generation:
+            player.release()  # 別の動画が読み込まれた
+            return
+        self.video_probes[i] = info
+        self.player_pool[i] = player
+        self._load_pending -= 1
+        # 読み込みが終わる前からスライダーの範囲を使えるようにする
+        self.max_frames = max(self.max_frames, info.frame_count)
+        self.frame_scale.configure(to=self.max_frames - 1 if self.max_frames > 0 else 0)
+        self.update_load_progress(i)
+    
+    def on_video_opened(self, generation, i, opened):
+        if generation != self._load_generation:
+            return  # 別の動画が読み込まれた（プレイヤーはon_video_probedで解放済み）
+        self._open_pending.discard(i)
+        if not opened:
+            self._load_failed.add(i)
+            player = self.player_pool.pop(i, None)
+            if player is None:
+                self._load_pending -= 1  # 動画情報も読めなかった
+                self.update_load_progress(i)
+                return
+            player.release()
+            if not self._load_pending:
+                # 表示を始めた後で開けなかった動画はリストから外して並べ直す
+                self.finish_loading()
+                return
+        if self._load_pending:
+            self.draw_placeholders()
+            return
+        if i in self.player_pool and self.player_pool[i] in self.video_players:
+            # 表示中のタイルのデコーダが開いたので、そのタイルだけ表示し直す
+            tile = self.video_players.index(self.player_pool[i])
+            if self.is_playing:
+                self.start_tile_prefetch(tile, first_frame=self.current_frame)
+            else:
+                self.update_frame_display()
+        if not self._open_pending:
+            self.status_label.config(text=self.loaded_text())
+    
+    def update_load_progress(self, i):
+        done = len(self.videos) - self._load_pending
+        self.status_label.config(text=f"動画を読み込み中... ({done}/{len(self.videos)}) "
+                                      f"{os.path.basename(self.videos[i])}")
+        self.draw_placeholders()
+        if self._load_pending == 0:
+            self.finish_loading()
+    
+    def loaded_text(self):
+        text = f"{len(self.videos)}個の動画を読み込みました"
+        if self._open_pending:
+            text += f"（デコーダを準備中: {len(self._open_pending)}個）"
+        return text
+    
+    def finish_loading(self):
+        # 開けなかった動画はリストから外す
+        failed = [os.path.basename(self.videos[i]) for i in sorted(self._load_failed)]
+        if failed:
+            if self.is_playing:
+                self.stop_playback()
+            keep = [i for i in range(len(self.videos)) if i not in self._load_failed]
+            self.videos = [self.videos[i] for i in keep]
+            self.player_pool = {new_i: self.player_pool[i] for new_i, i in enumerate(keep)}
+            self.video_probes = {new_i: self.video_probes[i] for new_i, i in enumerate(keep)}
+            self._open_pending = {new_i for new_i, i in enumerate(keep) if i in self._open_pending}
+            self.tile_offsets = {new_i: self.tile_offsets[i] for new_i, i in enumerate(keep)
+                                 if i in self.tile_offsets}
+            self._load_failed = set()
+            self.update_reference_choices()
         
         # レイアウトを更新
         self.update_layout()
         
-        messagebox.showinfo("読み込み完了", f"{len(video_paths)}個の動画を読み込みました")
+        # キーフレームインデックスをバックグラウンドで作成（キャッシュがあれば読み込むだけ）
+        self.start_indexing(list(self.videos))
+        
+        if self.proxy_var.get():
+            self.start_proxy_generation()
+        
+        text = self.loaded_text()
+        if failed:
+            text += f"（開けなかった動画: {', '.join(failed)}）"
+        self.status_label.config(text=text)
+    
+    def draw_placeholders(self):
+        # 読み込み中は動画ごとの枠に名前と進み具合を表示する
+        self.canvas.delete("all")
+        self.display_buffer = None
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if canvas_size[0] <= 1 or canvas_size[1] <= 1:
+            return
+        try:
+            tile_layout = compute_tile_layout(self.layout_var.get(), canvas_size, len(self.videos))
+        except ValueError:
+            return
+        for i, (video_path, ((x, y), (w, h))) in enumerate(zip(self.videos, tile_layout)):
+            info = self.video_probes.get(i)
+            if i in self._load_failed:
+                state = "開けませんでした"
+            elif info is None:
+                state = "読み込み中..."
+            elif i not in self._open_pending:
+                state = f"{info.describe()}\n準備完了"
+            else:
+                state = f"{info.describe()}\nデコーダを準備中..."
+            self.canvas.create_rectangle(x, y, x + w - 1, y + h - 1, outline="gray40", tags="placeholder")
+            self.canvas.create_text(x + w // 2, y + h // 2, text=f"{os.path.basename(video_path)}\n{state}",
+                                    fill="gray80", font=("Arial", max(8, min(14, w // 30))),
+                                    justify=tk.CENTER, anchor=tk.CENTER, tags="placeholder")
+    
+    def start_indexing(self, video_paths):
+        self._index_generation += 1
+        generation = self._index_generation
+        
+        def index_loop():
+            for video_path in video_paths:
+                if generation != self._index_generation:
+                    return  # 別の動画が読み込まれた
+                if video_path in self.video_indexes:
+                    continue
+                try:
+                    index = VideoIndex.load_or_build(video_path)
+                except Exception as e:
+                    print(f"インデックス作成エラー ({video_path}): {e}")
+                    continue
+                if index is not None:
+                    self.root.after(0, lambda p=video_path, idx=index: self.apply_index(p, idx))
+            # インデックスができてからサムネイルを作る（キーフレームを使うとデコードが少なくて済む）
+            self.root.after(0, lambda: self.start_thumbnail_generation(video_paths))
+        
+        threading.Thread(target=index_loop, daemon=True).start()
+    
+    def apply_index(self, video_path, index):
+        # インデックスの準備ができたプレイヤーに設定する
+        self.video_indexes[video_path] = index
+        for player in self.player_pool.values():
+            if player.video_path == video_path:
+                player.set_index(index)
+        # 正確なフレーム数とタイムスタンプで全体の時計を作り直す
+        if any(player.video_path == video_path for player in self.video_players):
+            self.rebuild_timeline()
+            self.redraw_filmstrip()
+            self.redraw_heatmap()
+            self.restart_prefetch_if_playing()
+    
+    def rebuild_timeline(self):
+        # 表示中のタイルのfps・タイムスタンプ・開始のずれから、全体の時計のフレーム番号 -> タイルのフレーム番号の
+        # 対応表を作る（fpsの違う動画や途中から始まる動画も時刻で揃える。表示時は配列を引くだけ）
+        sources = []
+        for player in self.video_players:
+            index = player.source_index
+            sources.append((player.frame_count, player.fps, index.pts_ms if index is not None else None))
+        offsets = [self.tile_offsets.get(i, 0.0) for i in range(len(self.video_players))]
+        self.timeline_fps, tables = build_timeline(sources, offsets)
+        for player, table in zip(self.video_players, tables):
+            player.set_timeline(table)
+        self.max_frames = len(tables[0]) if tables else 0
+        self.frame_scale.configure(to=self.max_frames - 1 if self.max_frames > 0 else 0)
+        if self.current_frame >= self.max_frames:
+            self.current_frame = max(0, self.max_frames - 1)
+            self.frame_var.set(self.current_frame)
+        # 表示中のフレームは古い対応表で選んだものなので読み直させる
+        self.tile_frames = [None] * len(self.video_players)
+    
+    def shift_tile_offset(self, frames):
+        # マウスが乗っているタイルの開始位置を全体の時計のframesフレーム分ずらす（正なら先の場面を表示する）
+        # ずれは秒で持ち、正なら遅れて始まる（--offsetsと同じ）
+        i = self.focus_tile
+        if i is None or i >= len(self.video_players) or self._load_pending:
+            return
+        offset = round(self.tile_offsets.get(i, 0.0) - frames / self.timeline_fps, 6)
+        if offset:
+            self.tile_offsets[i] = offset
+        else:
+            self.tile_offsets.pop(i, None)
+        self.rebuild_timeline()
+        self.draw_tile_labels()
+        self.redraw_filmstrip()
+        self.redraw_heatmap()
+        if self.is_playing:
+            self.restart_prefetch_if_playing()
+        else:
+            self.scrub_to(self.current_frame)
+        self.status_label.config(text=f"{os.path.basename(self.video_players[i].video_path)} の開始のずれ: "
+                                      f"{offset:+.3f}秒")
+    
+    def start_thumbnail_generation(self, video_paths):
+        if video_paths != self.videos:
+            return  # 別の動画が読み込まれた
+        if self._thumbnail_cancel is not None:
+            self._thumbnail_cancel.set()
+        cancel_event = threading.Event()
+        self._thumbnail_cancel = cancel_event
+        indexes = {path: self.video_indexes.get(path) for path in video_paths}
+        
+        def thumbnail_loop():
+            # 再生を妨げないように優先度を下げ、再生中は作成を止める
+            lower_thread_priority()
+            for i, video_path in enumerate(video_paths):
+                if cancel_event.is_set():
+                    return
+                if video_path in self.thumbnail_stores:
+                    continue
+                self.root.after(0, lambda i=i: self.status_label.config(
+                    text=f"サムネイル作成中 {i + 1}/{len(video_paths)}"))
+                try:
+                    store = ThumbnailStore.load_or_build(video_path, indexes[video_path],
+                                                         lambda: self.is_playing, cancel_event)
+                except Exception as e:
+                    print(f"サムネイル作成エラー ({video_path}): {e}")
+                    continue
+                if store is not None and not cancel_event.is_set():
+                    self.root.after(0, lambda p=video_path, s=store: self.apply_thumbnails(p, s))
+            if not cancel_event.is_set():
+                self.root.after(0, lambda: self.status_label.config(text=""))
+        
+        threading.Thread(target=thumbnail_loop, name="thumbnails", daemon=True).start()
+    
+    def apply_thumbnails(self, video_path, store):
+        self.thumbnail_stores[video_path] = store
+        self.redraw_filmstrip()
+    
+    def filmstrip_frame_at(self, x):
+        width = max(1, self.filmstrip.winfo_width())
+        return min(max(0, int(x / width * self.max_frames)), max(0, self.max_frames - 1))
+    
+    def timeline_frames(self, video_path):
+        # 全体の時計の各フレームに対応するその動画のフレーム番号（-1は開始前、フレーム数以上は終了後）
+        # 表示していない動画は全体の時計と揃えようがないのでフレーム番号をそのまま使う
+        for player in self.video_players:
+            if player.video_path == video_path and player.timeline is not None:
+                return np.asarray(player.timeline[:self.max_frames])
+        return np.arange(self.max_frames)
+    
+    def redraw_filmstrip(self):
+        # 1本目の動画のサムネイルをタイムラインの幅に並べ、1枚の画像として描画する
+        # （全体の時計で並べるので、1本目の開始前の部分は黒）
+        width = self.filmstrip.winfo_width()
+        store = self.thumbnail_stores.get(self.videos[0]) if self.videos else None
+        if store is None or width <= 1 or self.max_frames <= 0:
+            self.filmstrip.delete("strip")
+            return
+        frames = self.timeline_frames(self.videos[0])
+        thumb_width, thumb_height = store.size
+        strip = np.zeros((thumb_height, width, 3), dtype=np.uint8)
+        for x in range(0, width, thumb_width):
+            w = min(thumb_width, width - x)
+            frame_number = frames[self.filmstrip_frame_at(x + w / 2)]
+            if frame_number >= 0:
+                strip[:, x:x + w] = store.nearest(frame_number)[:, :w]
+        self.filmstrip_photo = ImageTk.PhotoImage(Image.fromarray(strip))
+        self.filmstrip.delete("strip")
+        self.filmstrip.create_image(0, 2, anchor=tk.NW, image=self.filmstrip_photo, tags="strip")
+        self.update_filmstrip_cursor()
+    
+    def update_filmstrip_cursor(self):
+        # 現在位置を示す線
+        if self.max_frames <= 0:
+            return
+        x = self.current_frame / self.max_frames * self.filmstrip.winfo_width()
+        height = ThumbnailStore.HEIGHT + 4
+        if self.filmstrip.find_withtag("cursor"):
+            self.filmstrip.coords("cursor", x, 0, x, height)
+        else:
+            self.filmstrip.create_line(x, 0, x, height, fill="red", width=2, tags="cursor")
+        self.filmstrip.tag_raise("cursor")
+    
+    def on_filmstrip_click(self, event):
+        if self.max_frames <= 0:
+            return
+        frame_number = self.filmstrip_frame_at(event.x)
+        self.frame_var.set(frame_number)
+        self.seek_frame(frame_number)
+    
+    def on_filmstrip_hover(self, event):
+        # 表示中の全タイルのその位置のサムネイルをレイアウトどおりに並べて表示する（デコーダは使わない）
+        stores = [self.thumbnail_stores.get(player.video_path) for player in self.video_players]
+        available = [store for store in stores if store is not None]
+        if not available:
+            return
+        frame_number = self.filmstrip_frame_at(event.x)
+        try:
+            rows, cols = parse_layout(self.layout_var.get())
+        except ValueError:
+            return  # レイアウトの入力途中
+
+        cols = min(cols, len(stores))
+        rows = min(rows, (len(stores) + cols - 1) // cols)
+        cell_width = max(store.size[0] for store in available)
+        cell_height = max(store.size[1] for store in available)
+        preview = np.full((rows * cell_height, cols * cell_width, 3), 40, dtype=np.uint8)
+        for i, (player, store) in enumerate(zip(self.video_players, stores)):
+            tile_frame = player.map_frame(frame_number)
+            if store is None or tile_frame < 0:
+                continue
+            thumb = store.nearest(tile_frame)
+            h, w = thumb.shape[:2]
+            x = (i % cols) * cell_width + (cell_width - w) // 2
+            y = (i // cols) * cell_height + (cell_height - h) // 2
+            preview[y:y + h, x:x + w] = thumb
+        
+        if self.preview_window is None:
+            self.preview_window = tk.Toplevel(self.root)
+            self.preview_window.overrideredirect(True)
+            self.preview_label = tk.Label(self.preview_window, bg="black", fg="white", compound=tk.TOP)
+            self.preview_label.pack()
+        self.preview_photo = ImageTk.PhotoImage(Image.fromarray(preview))
+        self.preview_label.config(image=self.preview_photo, text=f"Frame: {frame_number}")
+        x = event.x_root - preview.shape[1] // 2
+        y = self.filmstrip.winfo_rooty() + self.filmstrip.winfo_height() + 4
+        self.preview_window.geometry(f"+{x}+{y}")
+        self.preview_window.deiconify()
+        self.preview_window.lift()
+    
+    def hide_thumbnail_preview(self):
+        if self.preview_window is not None:
+            self.preview_window.withdraw()
+    
+    def reference_index(self):
+        # 基準に選ばれている動画の番号（"番号: ファイル名" の形式）
+        try:
+            return min(int(self.reference_var.get().split(':')[0]) - 1, len(self.videos) - 1)
+        except ValueError:
+            return 0
+    
+    def on_reference_change(self):
+        if self.diff_tile_var.get():
+            self.update_layout()
+        if self.diff_results:
+            self.start_diff_analysis()
+    
+    def start_diff_analysis(self):
+        if len(self.videos) < 2:
+            return
+        if self._diff_cancel is not None:
+            self._diff_cancel.set()
+        cancel_event = threading.Event()
+        self._diff_cancel = cancel_event
+        reference_path = self.videos[self.reference_index()]
+        other_paths = [path for path in self.videos if path != reference_path]
+        with_ssim = self.ssim_var.get()
+        
+        def diff_loop():
+            def progress(done, total):
+                percent = done / total * 100 if total > 0 else 0
+                self.root.after(0, lambda: self.status_label.config(text=f"差分解析中 ({percent:.0f}%)"))
+            try:
+                results = DiffMetrics.analyze(reference_path, other_paths, with_ssim,
+                                              cancel_event=cancel_event, progress_callback=progress)
+            except Exception as e:
+                print(f"差分解析エラー: {e}")
+                results = None
+            if cancel_event.is_set():
+                return
+            self.root.after(0, lambda: self.status_label.config(text=""))
+            if results is not None:
+                self.root.after(0, lambda: self.apply_diff_results(reference_path, results))
+        
+        threading.Thread(target=diff_loop, name="diff analysis", daemon=True).start()
+    
+    def apply_diff_results(self, reference_path, results):
+        if reference_path not in self.videos:
+            return
+        self.diff_reference = reference_path
+        self.diff_results = results
+        self.redraw_heatmap()
+    
+    def redraw_heatmap(self):
+        # 各列に対応するフレーム範囲の平均絶対差の最大値を色で表す（全ペア共通のスケール）
+        rows = [path for path in self.videos if path in self.diff_results]
+        row_height = 6
+        self.heatmap.configure(height=row_height * len(rows))
+        self.heatmap.delete("heat")
+        width = self.heatmap.winfo_width()
+        if not rows or width <= 1 or self.max_frames <= 0:
+            return
+        columns = (np.arange(width) * self.max_frames) // width
+        starts = np.unique(columns)
+        # 差分は基準動画のフレーム番号ごとに求めてあるので、基準動画の対応表で全体の時計に並べ直す
+        # （比較する動画どうしはフレーム番号で揃えたままで、fpsや開始のずれは考慮していない）
+        reference_frames = self.timeline_frames(self.diff_reference)
+        peaks = []
+        for path in rows:
+            values = np.nan_to_num(self.diff_results[path].mad)
+            mad = np.zeros(self.max_frames, dtype=np.float32)
+            valid = (reference_frames >= 0) & (reference_frames < len(values))
+            mad[valid] = values[reference_frames[valid]]
+            peaks.append(np.maximum.reduceat(mad, starts))
+        scale = max(float(row.max()) for row in peaks) or 1.0
+        image = np.zeros((row_height * len(rows), width, 3), dtype=np.uint8)
+        for r, row in enumerate(peaks):
+            level = np.clip(row / scale * 255, 0, 255).astype(np.uint8)
+            colors = cv2.applyColorMap(level.reshape(1, -1), cv2.COLORMAP_INFERNO)[0, :, ::-1]
+            image[r * row_height:(r + 1) * row_height - 1] = colors[np.searchsorted(starts, columns)]
+        self.heatmap_photo = ImageTk.PhotoImage(Image.fromarray(image))
+        self.heatmap.create_image(0, 0, anchor=tk.NW, image=self.heatmap_photo, tags="heat")
+    
+    def on_heatmap_hover(self, event):
+        # マウス位置の行の動画とフレームの指標を表示する
+        rows = [path for path in self.videos if path in self.diff_results]
+        if not rows or self.max_frames <= 0:
+            return
+        path = rows[min(len(rows) - 1, max(0, event.y // 6))]
+        frame_number = self.filmstrip_frame_at(event.x)
+        reference_frame = int(self.timeline_frames(self.diff_reference)[frame_number])
+        text = self.diff_results[path].metrics_at(reference_frame)
+        if text is not None:
+            self.status_label.config(text=f"{os.path.basename(path)} vs {os.path.basename(self.diff_reference)} "
+                                          f"Frame {frame_number} (基準 {reference_frame}): {text}")
+    
+    def compose_diff_tile(self):
+        # 基準タイルと比較タイルの差の絶対値を強調して差分タイルに書き込む
+        if self.diff_tile is None or self.diff_pair is None:
+            return
+        reference_i, other_i = self.diff_pair
+        if max(reference_i, other_i) >= len(self.tile_images):
+            return
+        reference = self.tile_images[reference_i]
+        other = self.tile_images[other_i]
+        if reference is None or other is None:
+            return
+        (x, y), (w, h) = self.diff_tile
+        if reference.shape[:2] != (h, w):
+            reference = cv2.resize(reference, (w, h))
+        if other.shape[:2] != (h, w):
+            other = cv2.resize(other, (w, h))
+        self.display_buffer[y:y + h, x:x + w, :3] = cv2.convertScaleAbs(cv2.absdiff(reference, other), alpha=4)
+    
+    def on_proxy_toggle(self):
+        if self.proxy_var.get():
+            self.start_proxy_generation()
+        else:
+            # 元動画での表示に戻す
+            if self._proxy_cancel is not None:
+                self._proxy_cancel.set()
+            self.proxy_paths.clear()
+            for player in self.player_pool.values():
+                player.set_proxy(None)
+            self.status_label.config(text="")
+            self.update_frame_display(force=True)
+    
+    def start_proxy_generation(self):
+        if not self.videos:
+            return
+        if not self.video_players:
+            # レイアウトが確定してからタイルサイズに合わせて作成する
+            self.root.after(100, self.start_proxy_generation)
+            return
+        
+        if self._proxy_cancel is not None:
+            self._proxy_cancel.set()
+        cancel_event = threading.Event()
+        self._proxy_cancel = cancel_event
+        
+        # 現在のレイアウトで最も大きいタイルに合わせたサイズ（偶数に丸める）
+        width = max(player.size[0] for player in self.video_players)
+        height = max(player.size[1] for player in self.video_players)
+        size = (width + width % 2, height + height % 2)
+        video_paths = list(self.videos)
+        
+        def proxy_loop():
+            for i, video_path in enumerate(video_paths):
+                def progress(current, total, i=i):
+                    percent = current / total * 100 if total > 0 else 0
+                    self.root.after(0, lambda: self.status_label.config(
+                        text=f"プロキシ作成中 {i + 1}/{len(video_paths)} ({percent:.0f}%)"))
+                try:
+                    proxy_path = self.proxy_cache.get_or_create(video_path, size, cancel_event, progress)
+                except Exception as e:
+                    print(f"プロキシ作成エラー ({video_path}): {e}")
+                    continue
+                if cancel_event.is_set():
+                    return
+                if proxy_path is not None:
+                    self.root.after(0, lambda p=video_path, pp=proxy_path: self.apply_proxy(p, pp))
+            self.root.after(0, lambda: self.status_label.config(text=""))
+        
+        threading.Thread(target=proxy_loop, daemon=True).start()
+    
+    def apply_proxy(self, video_path, proxy_path):
+        if not self.proxy_var.get():
+            return
+        self.proxy_paths[video_path] = proxy_path
+        for player in self.player_pool.values():
+            if player.video_path == video_path:
+                player.set_proxy(proxy_path)
+        if not self.is_playing:
+            self.update_frame_display(force=True)
     
     def update_layout(self, event=None):
         if not self.videos:
             return
+        if self._load_pending:
+            # 読み込み中はデコーダを開かずに枠だけを並べ直す
+            self.draw_placeholders()
+            return
         
         layout = self.layout_var.get()
-        rows, cols = map(int, layout.split('x'))
         
         # キャンバスのサイズを強制的に更新
         self.canvas.update_idletasks()
@@ -222,144 +3105,505 @@ class VideoComparisonApp:
             self.root.after(50, self.update_layout)
             return
         
-        # 各動画のサイズを計算（マージンを考慮）
-        margin = 2  # 動画間のマージン
-        video_width = (canvas_width - margin * (cols - 1)) // cols
-        video_height = (canvas_height - margin * (rows - 1)) // rows
+        # 各動画の位置とサイズを計算
+        show_diff = self.diff_tile_var.get() and len(self.videos) >= 2
+        try:
+            tile_layout = compute_tile_layout(layout, (canvas_width, canvas_height),
+                                              len(self.videos) + int(show_diff))
+        except ValueError:
+            self.status_label.config(text=f"不正なレイアウトです: {layout}（例: 4x4）")
+            return
         
-        # 動画プレイヤーを再初期化
-        for player in self.video_players:
-            player.release()
-        self.video_players.clear()
+        # 差分タイルは最後のマスに表示する（基準と、基準以外で最初に表示される動画を比較）
+        self.diff_tile = None
+        self.diff_pair = None
+        if show_diff and len(tile_layout) >= 3:
+            self.diff_tile = tile_layout.pop()
+            reference_i = self.reference_index()
+            others = [i for i in range(len(tile_layout)) if i != reference_i]
+            if reference_i < len(tile_layout) and others:
+                self.diff_pair = (reference_i, others[0])
         
-        # キャンバスをクリアしてオブジェクト参照をリセット
-        self.canvas.delete("all")
-        if hasattr(self, 'canvas_objects'):
-            self.canvas_objects.clear()
-        if hasattr(self, 'photo_refs'):
-            self.photo_refs.clear()
+        self._layout_canvas_size = (canvas_width, canvas_height)
         
-        self.max_frames = 0
+        # 表示から外れるプレイヤーは先読みだけ止める（デコーダは開いたまま）
+        visible_count = len(tile_layout)
+        for i, player in self.player_pool.items():
+            if i >= visible_count:
+                player.stop_prefetch()
+                player.set_process_decode(False)
+        # 開いたままにする数を超えたデコーダは閉じる（ファイルハンドルとデコーダのメモリを抑える）
+        hidden = sorted(i for i in self.player_pool if i >= visible_count)
+        for i in hidden[self.max_idle_decoders:]:
+            self.player_pool.pop(i).release()
+        # タイルが多いほどデコーダ1つあたりの内部スレッドを減らす
+        decoder_threads = max(1, (os.cpu_count() or 1) // max(1, visible_count))
+        self.focus_tile = None
+        players = []
         
-        # 新しい動画プレイヤーを作成
-        for i, video_path in enumerate(self.videos[:rows * cols]):
-            row = i // cols
-            col = i % cols
-            
-            x = col * (video_width + margin)
-            y = row * (video_height + margin)
-            
-            player = VideoPlayer(video_path, (x, y), (video_width, video_height))
-            self.video_players.append(player)
-            
-            # 最大フレーム数を更新
-            self.max_frames = max(self.max_frames, player.frame_count)
+        # キャンバスサイズの合成バッファを作り直す
+        self.setup_display_surface(canvas_width, canvas_height)
         
-        # スライダーの範囲を更新
-        self.frame_scale.configure(to=self.max_frames - 1 if self.max_frames > 0 else 0)
+        # 位置とサイズだけを更新し、初めて表示する動画のみデコーダを開く
+        for i, (video_path, (position, size)) in enumerate(zip(self.videos, tile_layout)):
+            player = self.player_pool.get(i)
+            if player is None:
+                player = VideoPlayer(video_path, position, size, self.frame_cache,
+                                     self.video_indexes.get(video_path), self.proxy_paths.get(video_path),
+                                     decode_pool=self.decode_pool, decoder_threads=decoder_threads)
+                self.player_pool[i] = player
+            else:
+                player.set_geometry(position, size)
+            player.set_roi(self.roi)
+            players.append(player)
+        self.video_players = players
+        for player in players:
+            player.priority = False
+        self.apply_memory_budget()
+        if self.process_decode_var.get():
+            for player in players:
+                player.set_process_decode(True, self.prefetch_depth)
+        # 全体の時計とスライダーの範囲を更新
+        self.rebuild_timeline()
+        self.draw_tile_labels()
         self.update_frame_display()
+        self.redraw_filmstrip()
+        self.redraw_heatmap()
+        
+        # 再生中なら新しいサイズで先読みし直す
+        self.restart_prefetch_if_playing()
     
     def toggle_playback(self):
         self.is_playing = not self.is_playing
         if self.is_playing:
             self.play_videos()
+        else:
+            self.stop_playback()
+    
+    def stop_playback(self):
+        self.is_playing = False
+        if self._play_after_id is not None:
+            self.root.after_cancel(self._play_after_id)
+            self._play_after_id = None
+        self.stop_prefetch()
+    
+    def stop_prefetch(self):
+        for player in self.video_players:
+            player.stop_prefetch()
+        self.print_buffer_stats()
+    
+    def print_buffer_stats(self):
+        # 先読みバッファのサイズ調整用に統計を出力
+        for player in self.video_players:
+            stats = player.buffer_stats
+            if stats['delivered'] == 0 and stats['underruns'] == 0:
+                continue
+            avg_depth = stats['depth_sum'] / stats['delivered'] if stats['delivered'] else 0
+            print(f"{os.path.basename(player.video_path)}: 表示 {stats['delivered']} / "
+                  f"アンダーラン {stats['underruns']} / 平均深さ {avg_depth:.1f} / "
+                  f"最小深さ {stats['min_depth']} (N={player.prefetch_depth})")
+        cache = self.frame_cache
+        print(f"フレームキャッシュ: ヒット {cache.stats['hits']} / ミス {cache.stats['misses']} "
+              f"({cache.hit_rate * 100:.1f}%) / 使用 {cache.used_bytes / 1024 / 1024:.0f}MB")
+        if self.play_stats['shown']:
+            print(f"再生: 表示 {self.play_stats['shown']} / ドロップ {self.play_stats['dropped']}")
+    
+    def get_playback_fps(self):
+        # 再生の基準となる全体の時計のフレームレート（タイルの最も高いfps）
+        return self.timeline_fps
     
     def play_videos(self):
         if not self.is_playing or not self.video_players:
             return
         
-        start_time = time.time()
-        base_fps = 30
-        speed_multiplier = self.speed_var.get()
-        frame_interval = 1.0 / (base_fps * speed_multiplier)
+        self.play_stats = {'shown': 0, 'dropped': 0}
+        self._shown_times.clear()
+        self.rebase_play_clock()
         
-        def play_loop():
-            frame_counter = 0
-            while self.is_playing and self.current_frame < self.max_frames:
-                self.update_frame_display()
-                self.current_frame += 1
-                self.frame_var.set(self.current_frame)
-                
-                # フレームレート調整（速度に応じて）
-                frame_counter += 1
-                elapsed = time.time() - start_time
-                expected_time = frame_interval * frame_counter
-                sleep_time = expected_time - elapsed
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+        # 共有のデコードワーカーで先読みを開始
+        self.start_all_prefetch()
         
-        threading.Thread(target=play_loop, daemon=True).start()
+        # Tkのメインループ上でafter()を使って再生する（ワーカースレッドからTkを触らない）
+        self._play_after_id = self.root.after(0, self.play_tick)
+    
+    def rebase_play_clock(self):
+        # 再生時計の基準を現在のフレームと時刻に合わせる（開始・シーク・速度変更時）
+        # 1倍速より速い場合は元動画のfpsで表示を更新し、1回ごとにspeedフレームずつ進める
+        # 遅い場合はfps×speedで表示を更新し、1フレームずつ進める
+        speed = self.speed_var.get()
+        self._play_start_time = time.perf_counter()
+        self._play_start_frame = self.current_frame
+        self._play_stride = max(1.0, speed)
+        self._play_tick_rate = self.get_playback_fps() * speed / self._play_stride
+        self._play_last_tick = 0
+    
+    def play_tick(self):
+        self._play_after_id = None
+        if not self.is_playing:
+            return
+        
+        # 再生時計から今表示すべきフレームを求める
+        now = time.perf_counter()
+        tick_interval = 1.0 / self._play_tick_rate
+        tick = int((now - self._play_start_time) * self._play_tick_rate)
+        target = stride_frame(self._play_start_frame, tick, self._play_stride)
+        
+        if target >= self.max_frames:
+            # 最後まで再生したら停止
+            self.current_frame = max(0, self.max_frames - 1)
+            self.frame_var.set(self.current_frame)
+            self.update_frame_display()
+            self.stop_playback()
+            self.update_playback_label()
+            return
+        
+        if tick != self._play_last_tick:
+            # 間に合わなかったフレームは表示せずに飛ばす
+            if tick > self._play_last_tick + 1:
+                self.play_stats['dropped'] += tick - self._play_last_tick - 1
+            self._play_last_tick = tick
+            for player in self.video_players:
+                perf_tracer.counter('buffer depth', player.buffer_depth, player.label)
+            self.current_frame = target
+            self.frame_var.set(target)
+            self.update_frame_display(buffered=True, timeout=tick_interval / 2, tick=tick)
+            self.play_stats['shown'] += 1
+            self._shown_times.append(now)
+            self.update_playback_label()
+        
+        # 次のフレームの表示時刻まで待つ
+        next_due = self._play_start_time + (tick + 1) / self._play_tick_rate
+        delay_ms = max(1, int((next_due - time.perf_counter()) * 1000))
+        self._play_after_id = self.root.after(delay_ms, self.play_tick)
+    
+    def update_playback_label(self):
+        # 直近1秒間に表示したフレーム数から実効fpsを求める
+        now = time.perf_counter()
+        while self._shown_times and now - self._shown_times[0] > 1.0:
+            self._shown_times.popleft()
+        fps = len(self._shown_times) if self.is_playing else 0
+        self.playback_label.config(text=f"{fps:.0f} fps / ドロップ {self.play_stats['dropped']}")
+    
+    def on_speed_change(self, event=None):
+        # 速度が変わると読み飛ばし間隔も変わるので先読みし直す
+        self.restart_prefetch_if_playing()
     
     def seek_frame(self, value):
         self.current_frame = int(float(value))
-        self.update_frame_display()
+        if self.is_playing:
+            self.update_frame_display()
+            self.restart_prefetch_if_playing()
+        else:
+            # スライダーのドラッグ中に毎回デコードを待たないようにする
+            self.scrub_to(self.current_frame)
     
-    def update_frame_display(self):
-        if not self.video_players:
+    def on_process_decode_toggle(self):
+        enabled = self.process_decode_var.get()
+        for player in self.video_players:
+            player.set_process_decode(enabled, self.prefetch_depth)
+        self.restart_prefetch_if_playing()
+    
+    def restart_prefetch_if_playing(self):
+        # 再生中にシークした場合は新しい位置から先読みし直す
+        if self.is_playing:
+            self.rebase_play_clock()
+            self.start_all_prefetch()
+    
+    def start_all_prefetch(self):
+        # タイルが多い場合はフォーカス外のタイルの更新頻度を下げる（全体が止まらないようにする）
+        self.off_focus_every = max(1, math.ceil(len(self.video_players) / self.full_rate_tiles))
+        for i in range(len(self.video_players)):
+            self.start_tile_prefetch(i)
+    
+    def tile_refresh_every(self, i):
+        # タイルiを何回の表示更新に1回更新するか
+        if self.off_focus_every == 1 or i == self.focus_tile:
+            return 1
+        return self.off_focus_every
+    
+    def start_tile_prefetch(self, i, first_frame=None):
+        # 再生時計の基準フレームから、このタイルの更新タイミングのフレームだけを先読みする
+        self.video_players[i].start_prefetch(self._play_start_frame, self.prefetch_depth, self._play_stride,
+                                             self.tile_refresh_every(i), first_frame)
+    
+    def apply_memory_budget(self):
+        # フレームメモリの上限を先読みバッファ（最大1/4）とフレームキャッシュで分け合う
+        budget = self.frame_memory_budget_mb * 1024 * 1024
+        frame_bytes = sum(player.size[0] * player.size[1] * 3 for player in self.video_players)
+        if frame_bytes == 0:
             return
+        depth = int(budget / 4 / frame_bytes)
+        self.prefetch_depth = max(2, min(VideoPlayer.PREFETCH_DEPTH, depth))
+        self.frame_cache.set_budget(max(0, budget - frame_bytes * self.prefetch_depth) / 1024 / 1024)
+    
+    def tile_at(self, x, y):
+        for i, player in enumerate(self.video_players):
+            px, py = player.position
+            w, h = player.size
+            if px <= x < px + w and py <= y < py + h:
+                return i
+        return None
+    
+    def on_canvas_motion(self, event):
+        i = self.tile_at(event.x, event.y)
+        if i != self.focus_tile:
+            self.set_focus_tile(i)
+    
+    def set_focus_tile(self, i):
+        # マウスが乗っているタイルは毎回更新し、デコードも優先する
+        previous = self.focus_tile
+        self.focus_tile = i
+        for j, player in enumerate(self.video_players):
+            player.priority = j == i
+        if self.is_playing and self.off_focus_every > 1:
+            # 更新頻度が変わるタイルだけ先読みし直す
+            for j in {previous, i}:
+                if j is not None and j < len(self.video_players):
+                    self.start_tile_prefetch(j, first_frame=self.current_frame)
+    
+    def setup_display_surface(self, width, height):
+        # 全タイルを合成する1枚のバッファと、それを表示する1つのPhotoImageを用意する
+        # RGBAにしておくとPhotoImageへのpaste時に変換が不要になる
+        self.display_buffer = np.zeros((height, width, 4), dtype=np.uint8)
+        self.display_buffer[:, :, 3] = 255
+        # バッファとメモリを共有するPILイメージ（バッファを書き換えると内容も変わる）
+        self.display_image = Image.frombuffer('RGBA', (width, height), self.display_buffer, 'raw', 'RGBA', 0, 1)
+        t0 = perf_tracer.begin()
+        self.display_photo = ImageTk.PhotoImage('RGBA', (width, height))
+        self.display_photo.paste(self.display_image)
+        perf_tracer.end('photo setup', t0)
         
-        # 画像参照リストを初期化
-        if not hasattr(self, 'photo_refs'):
-            self.photo_refs = []
+        self.canvas.delete("all")
+        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.display_photo, tags="display")
+        self.tile_frames = []
+    
+    def draw_tile_labels(self):
+        # ファイル名ラベルはレイアウト変更時に一度だけ描画する
+        self.canvas.delete("label")
+        labels = [(player.position, player.size, os.path.basename(player.video_path)) for player in self.video_players]
+        for i, offset in self.tile_offsets.items():
+            if i < len(labels):
+                position, size, filename = labels[i]
+                labels[i] = (position, size, f"{filename} ({offset:+.3f}秒)")
+        if self.diff_tile is not None and self.diff_pair is not None:
+            reference_i, other_i = self.diff_pair
+            labels.append((*self.diff_tile, f"差分 {labels[other_i][2]} - {labels[reference_i][2]}"))
+        for (x, y), size, filename in labels:
+            text_x = x + size[0] // 2
+            text_y = y + size[1] - 20
+            font_size = max(8, min(16, size[0] // 30))
+            self.canvas.create_text(text_x, text_y, text=filename, fill="white",
+                                    font=("Arial", font_size), anchor=tk.CENTER, tags="label")
+        self.canvas.tag_raise("label")
+    
+    def update_frame_display(self, buffered=False, timeout=0.0, force=False, tick=None):
+        if not self.video_players or self.display_buffer is None:
+            return
         
-        # 必要に応じてリストを拡張
-        while len(self.photo_refs) < len(self.video_players):
-            self.photo_refs.append(None)
+        display_t0 = perf_tracer.begin()
         
-        # キャンバスオブジェクトIDリストを初期化
-        if not hasattr(self, 'canvas_objects'):
-            self.canvas_objects = []
-            # 初回はcanvasをクリア
-            self.canvas.delete("all")
+        # タイルごとに最後に合成したフレーム番号
+        if len(self.tile_frames) != len(self.video_players):
+            self.tile_frames = [None] * len(self.video_players)
         
-        # 必要に応じてリストを拡張
-        while len(self.canvas_objects) < len(self.video_players) * 2:  # 画像とテキスト用
-            self.canvas_objects.append(None)
+        # 全タイル共通の待ち時間の期限
+        deadline = time.time() + timeout
+        changed = False
         
         for i, player in enumerate(self.video_players):
-            frame = player.get_frame(self.current_frame)
-            if frame is not None:
-                # PILイメージに変換
-                pil_image = Image.fromarray(frame)
-                photo = ImageTk.PhotoImage(pil_image)
-                
-                # 参照を保持
-                self.photo_refs[i] = photo
-                
-                x, y = player.position
-                
-                # 画像の更新または作成
-                img_index = i * 2  # 画像用インデックス
-                text_index = i * 2 + 1  # テキスト用インデックス
-                
-                if self.canvas_objects[img_index] is None:
-                    # 新規作成
-                    self.canvas_objects[img_index] = self.canvas.create_image(x, y, anchor=tk.NW, image=photo)
-                else:
-                    # 既存のオブジェクトを更新
-                    self.canvas.itemconfig(self.canvas_objects[img_index], image=photo)
-                    self.canvas.coords(self.canvas_objects[img_index], x, y)
-                
-                # ファイル名テキストの処理
-                filename = os.path.basename(player.video_path)
-                text_x = x + player.size[0] // 2
-                text_y = y + player.size[1] - 20
-                font_size = max(8, min(16, player.size[0] // 30))
-                
-                if self.canvas_objects[text_index] is None:
-                    # 新規作成
-                    self.canvas_objects[text_index] = self.canvas.create_text(
-                        text_x, text_y, text=filename, fill="white", 
-                        font=("Arial", font_size), anchor=tk.CENTER
-                    )
-                else:
-                    # 既存のテキストを更新
-                    self.canvas.itemconfig(self.canvas_objects[text_index], 
-                                         text=filename, font=("Arial", font_size))
-                    self.canvas.coords(self.canvas_objects[text_index], text_x, text_y)
+            # fpsの違うタイルは時計が進んでもフレームが変わらないことがある
+            frame_number = player.map_frame(self.current_frame)
+            if not force and self.tile_frames[i] == frame_number:
+                continue  # フレームが変わっていないタイルはデコードも再合成もしない
+            every = self.tile_refresh_every(i)
+            if tick is not None and tick % every != 0:
+                continue  # 更新頻度を下げているタイル
+            if frame_number < 0:
+                changed |= self.clear_tile(i, player)  # まだ始まっていないタイル
+                continue
+            
+            t0 = perf_tracer.begin()
+            if buffered:
+                # 再生中は先読みバッファからのみ取得する（更新頻度を下げているタイルは待たない）
+                wait = max(0.0, deadline - time.time()) if every == 1 else 0.0
+                frame = player.get_buffered_frame(frame_number, wait)
+                perf_tracer.end('wait', t0, player.label)
+            else:
+                frame = player.get_frame(frame_number)
+                perf_tracer.end('get_frame', t0, player.label)
+            if frame is None:
+                continue
+            
+            if self.composite_tile(i, player, frame, frame_number):
+                changed = True
+        
+        if changed:
+            self.present_display()
         
         # フレーム情報を更新
         self.frame_label.config(text=f"Frame: {self.current_frame}/{self.max_frames}")
+        self.update_filmstrip_cursor()
+        perf_tracer.end('display', display_t0)
+        self.update_hud()
+    
+    def composite_tile(self, i, player, frame, frame_number):
+        # 合成バッファの該当タイル位置に書き込む（frame_numberがNoneなら下書きとして扱う）
+        x, y = player.position
+        h, w = frame.shape[:2]
+        if (w, h) != tuple(player.size):
+            return False  # リサイズ前のサイズで先読みされたフレーム
+        t0 = perf_tracer.begin()
+        self.display_buffer[y:y + h, x:x + w, :3] = frame
+        perf_tracer.end('composite', t0)
+        self.tile_frames[i] = frame_number
+        if len(self.tile_images) != len(self.video_players):
+            self.tile_images = [None] * len(self.video_players)
+        self.tile_images[i] = frame
+        return True
+    
+    def clear_tile(self, i, player):
+        # 開始前のタイルは黒で塗りつぶす
+        x, y = player.position
+        w, h = player.size
+        self.display_buffer[y:y + h, x:x + w, :3] = 0
+        self.tile_frames[i] = -1
+        if len(self.tile_images) != len(self.video_players):
+            self.tile_images = [None] * len(self.video_players)
+        self.tile_images[i] = None
+        return True
+    
+    def present_display(self):
+        self.compose_diff_tile()
+        # 1つのPhotoImageにまとめて転送
+        t0 = perf_tracer.begin()
+        self.display_photo.paste(self.display_image)
+        perf_tracer.end('paste', t0)
+        if perf_tracer.enabled:
+            # 計測中はキャンバスの再描画をここで済ませて時間を測る
+            t0 = perf_tracer.begin()
+            self.canvas.update_idletasks()
+            perf_tracer.end('canvas', t0)
+    
+    def scrub_to(self, frame_number):
+        # スライダー操作中はデコードを待たずに表示する
+        # キャッシュにあるフレーム（なければ直前のキーフレーム）をすぐに表示し、残りはタイルごとのスレッドで
+        # キーフレームの下書きをデコードする。スライダーが止まったら正確なフレームに差し替える
+        if not self.video_players or self.display_buffer is None:
+            return
+        if len(self.tile_frames) != len(self.video_players):
+            self.tile_frames = [None] * len(self.video_players)
+        
+        changed = False
+        for i, player in enumerate(self.video_players):
+            tile_frame = player.map_frame(frame_number)
+            if self.tile_frames[i] == tile_frame:
+                continue
+            if tile_frame < 0:
+                changed |= self.clear_tile(i, player)
+                continue
+            frame = self.frame_cache.get(player.video_path, tile_frame, player.size, player.roi)
+            if frame is not None:
+                changed |= self.composite_tile(i, player, frame, tile_frame)
+                continue
+            index = player.index
+            if index is not None:
+                keyframe = index.keyframe_before(tile_frame)
+                frame = self.frame_cache.get(player.video_path, keyframe, player.size, player.roi)
+                if frame is not None:
+                    # 下書きとして表示し、正確なフレームはスライダーが止まってから読む
+                    changed |= self.composite_tile(i, player, frame, None)
+                    continue
+            player.request_scrub(tile_frame, True, self.on_scrub_frame)
+        if changed:
+            self.present_display()
+        self.frame_label.config(text=f"Frame: {frame_number}/{self.max_frames}")
+        self.update_filmstrip_cursor()
+        
+        if self._scrub_after_id is not None:
+            self.root.after_cancel(self._scrub_after_id)
+        self._scrub_after_id = self.root.after(self.scrub_settle_ms, self.refine_scrub)
+    
+    def refine_scrub(self):
+        # スライダーが止まったので正確なフレームをデコードする
+        self._scrub_after_id = None
+        if self.is_playing:
+            return
+        for i, player in enumerate(self.video_players):
+            frame_number = player.map_frame(self.current_frame)
+            if frame_number < 0 or i < len(self.tile_frames) and self.tile_frames[i] == frame_number:
+                continue
+            player.request_scrub(frame_number, False, self.on_scrub_frame)
+    
+    def on_scrub_frame(self, player, frame_number, decoded_number, frame):
+        # デコードワーカーから（ロックを持たずに）呼ばれるので表示はメインスレッドで行う
+        self.root.after(0, lambda: self.apply_scrub_frame(player, frame_number, decoded_number, frame))
+    
+    def apply_scrub_frame(self, player, frame_number, decoded_number, frame):
+        # 古い要求の結果や再生開始後に届いた結果は表示しない
+        if frame is None or self.is_playing or player not in self.video_players:
+            return
+        if frame_number != player.map_frame(self.current_frame):
+            return
+        i = self.video_players.index(player)
+        if i >= len(self.tile_frames) or self.tile_frames[i] == frame_number:
+            return  # 正確なフレームを表示済み
+        exact = decoded_number == frame_number
+        if self.composite_tile(i, player, frame, frame_number if exact else None):
+            self.present_display()
+    
+    def on_hud_toggle(self):
+        perf_tracer.enabled = self.hud_var.get() or perf_tracer.tracing
+        perf_tracer.clear()
+        if self.hud_var.get():
+            self.update_hud(force=True)
+        else:
+            self.canvas.delete("hud")
+    
+    def update_hud(self, force=False):
+        # 処理段階ごとの平均時間・実効fps・先読みバッファの深さを画面左上に重ねて表示する
+        if not self.hud_var.get():
+            return
+        now = time.perf_counter()
+        if not force and now - self._hud_updated_at < 0.25:
+            return
+        self._hud_updated_at = now
+        
+        def ms(name, tile=None):
+            value = perf_tracer.mean_ms(name, tile)
+            return "-" if value is None else f"{value:.1f}"
+        
+        while self._shown_times and now - self._shown_times[0] > 1.0:
+            self._shown_times.popleft()
+        fps = len(self._shown_times) if self.is_playing else 0
+        lines = [f"{fps} fps / ドロップ {self.play_stats['dropped']} / 表示 {ms('display')}ms "
+                 f"(合成 {ms('composite')} 転送 {ms('paste')} 描画 {ms('canvas')})"]
+        for player in self.video_players:
+            wait_name = 'wait' if self.is_playing else 'get_frame'
+            lines.append(f"{player.label}: シーク {ms('seek', player.label)} デコード {ms('decode', player.label)} "
+                         f"リサイズ {ms('resize', player.label)} 変換 {ms('cvtColor', player.label)} "
+                         f"待ち {ms(wait_name, player.label)}ms / バッファ {player.buffer_depth}/{player.prefetch_depth}")
+        text = "\n".join(lines)
+        
+        if self.canvas.find_withtag("hud"):
+            self.canvas.itemconfigure("hud", text=text)
+        else:
+            self.canvas.create_text(8, 8, text=text, anchor=tk.NW, fill="yellow", font=("Courier", 9), tags="hud")
+        self.canvas.tag_raise("hud")
+    
+    def toggle_trace(self):
+        # 1回目で記録を開始し、2回目でChromeトレース形式（chrome://tracing、Perfetto）のファイルに保存する
+        if not perf_tracer.tracing:
+            perf_tracer.start_trace()
+            self.trace_button.config(text="トレース保存")
+            return
+        perf_tracer.stop_trace(keep_enabled=self.hud_var.get())
+        self.trace_button.config(text="トレース開始")
+        path = filedialog.asksaveasfilename(title="トレースの保存", defaultextension=".json",
+                                            initialfile="video_comparison_trace.json",
+                                            filetypes=[("Chrome trace", "*.json")])
+        if path:
+            count = perf_tracer.dump_chrome_trace(path)
+            print(f"トレースを保存しました: {path} ({count}イベント)")
     
     def save_video(self):
         if not self.video_players:
@@ -378,20 +3622,41 @@ class VideoComparisonApp:
         else:
             speed_suffix = f"_x{speed}".replace(".", "p")  # ドットをpに置換（ファイル名対応）
         
-        output_filename = f"{base_name}_comparison{speed_suffix}.mp4"
+        # ズーム中は拡大した範囲だけを保存する（全体を保存したファイルを上書きしないように名前を変える）
+        roi = self.roi
+        zoom_suffix = "_zoom" if roi is not None else ""
+        output_filename = f"{base_name}_comparison{speed_suffix}{zoom_suffix}.mp4"
         output_path = os.path.join(output_dir, output_filename)
         
+        # 保存に必要な設定はTkのメインスレッドで取得しておく
+        self.canvas.update_idletasks()
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        tiles = [(player.video_path, player.position, player.size) for player in self.video_players]
+        # 表示と同じ対応表で揃え、全体の時計のfpsで書き出す
+        timelines = [player.timeline for player in self.video_players]
+        # 作成済みのインデックスを使う（まだのものは保存処理の最初に一度だけ作る）
+        indexes = [player.source_index for player in self.video_players]
+        export_workers = self.export_workers_var.get()
+        self.encoder_settings = {'backend': self.encoder_var.get(), 'codec': self.codec_var.get(),
+                                 'crf': int(self.crf_var.get()), 'preset': self.preset_var.get(),
+                                 'threads': int(self.encoder_threads_var.get())}
+        encoder = dict(self.encoder_settings)
+        
         # 進捗ウィンドウを表示
+        self._export_cancel = threading.Event()
         self.show_progress_window()
         
         # 保存処理を別スレッドで実行
-        threading.Thread(target=self._save_video_process, args=(output_path,), daemon=True).start()
+        threading.Thread(target=self._save_video_process,
+                         args=(output_path, tiles, canvas_size, speed, export_workers, encoder, self._export_cancel,
+                               roi, timelines, self.timeline_fps, indexes),
+                         daemon=True).start()
     
     def show_progress_window(self):
         # 進捗表示ウィンドウ
         self.progress_frame = tk.Toplevel(self.root)
         self.progress_frame.title("動画保存中")
-        self.progress_frame.geometry("400x120")
+        self.progress_frame.geometry("400x160")
         self.progress_frame.resizable(False, False)
         self.progress_frame.transient(self.root)
         self.progress_frame.grab_set()
@@ -411,8 +3676,16 @@ class VideoComparisonApp:
         self.progress_bar = ttk.Progressbar(self.progress_frame, length=350, mode='determinate')
         self.progress_bar.pack(pady=10)
         
-        # キャンセルボタン（今回は実装しないが、将来の拡張用）
-        # ttk.Button(self.progress_frame, text="キャンセル").pack(pady=10)
+        # キャンセルボタン（書き終えた部分動画は残るので、同じ設定で保存し直すと続きから再開する）
+        self.cancel_button = ttk.Button(self.progress_frame, text="キャンセル", command=self.cancel_export)
+        self.cancel_button.pack(pady=10)
+        self.progress_frame.protocol("WM_DELETE_WINDOW", self.cancel_export)
+    
+    def cancel_export(self):
+        if self._export_cancel is not None and not self._export_cancel.is_set():
+            self._export_cancel.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_label.config(text="キャンセル中...")
     
     def update_progress(self, current, total, message=""):
         if self.progress_bar and self.progress_label:
@@ -432,163 +3705,62 @@ class VideoComparisonApp:
             self.progress_frame = None
             self.progress_bar = None
             self.progress_label = None
+            self.cancel_button = None
     
-    def _save_video_process(self, output_path):
+    def _save_video_process(self, output_path, tiles, canvas_size, speed_multiplier, export_workers, encoder=None,
+                            cancel_event=None, roi=None, timelines=None, fps=30, indexes=None):
         try:
             # 進捗更新
             self.root.after(0, lambda: self.update_progress(0, self.max_frames, "動画の初期化中..."))
             
-            # 現在のキャンバスサイズを取得
-            self.canvas.update_idletasks()
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            
-            # 再生速度を取得
-            speed_multiplier = self.speed_var.get()
-            
-            # VideoWriterを初期化（固定30FPS）
-            output_fps = 30
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, output_fps, (canvas_width, canvas_height))
+            # 出力タイムライン（出力フレームごとの元フレーム番号）
+            frame_indices = export_frame_indices(self.max_frames, speed_multiplier)
             
-            # 速度に応じたフレーム処理の計算
-            if speed_multiplier >= 1.0:
-                # 高速再生：フレームをスキップ
-                frame_step = speed_multiplier  # 例：2倍速なら2フレームごと
-                total_output_frames = int(self.max_frames / speed_multiplier)
-            else:
-                # 低速再生：フレームを複製
-                frame_step = 1
-                frame_repeat = int(1 / speed_multiplier)  # 例：0.5倍速なら各フレームを2回
-                total_output_frames = self.max_frames * frame_repeat
-            
-            output_frame_count = 0
+            def progress(done, total):
+                self.root.after(0, lambda: self.update_progress(done, total))
             
-            if speed_multiplier >= 1.0:
-                # 高速再生の処理
-                for i in range(total_output_frames):
-                    frame_num = int(i * frame_step)
-                    if frame_num >= self.max_frames:
-                        break
-                    
-                    # 進捗更新
-                    if output_frame_count % 10 == 0:
-                        progress = output_frame_count / total_output_frames
-                        self.root.after(0, lambda p=progress: self.update_progress(int(p * total_output_frames), total_output_frames))
-                    
-                    # 合成フレームを作成
-                    combined_frame = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
-                    
-                    for player in self.video_players:
-                        frame = player.get_frame(frame_num)
-                        if frame is not None:
-                            x, y = player.position
-                            w, h = player.size
-                            
-                            # フレームを配置
-                            combined_frame[y:y+h, x:x+w] = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                            
-                            # ファイル名を描画
-                            filename = os.path.basename(player.video_path)
-                            text_x = x + w // 2
-                            text_y = y + h - 10
-                            
-                            # テキストサイズを計算（動的にスケール調整）
-                            font = cv2.FONT_HERSHEY_SIMPLEX
-                            font_scale = min(w, h) / 400
-                            font_scale = max(0.3, min(1.0, font_scale))
-                            thickness = max(1, int(font_scale * 2))
-                            text_size = cv2.getTextSize(filename, font, font_scale, thickness)[0]
-                            
-                            # テキストの背景を描画（可読性向上）
-                            bg_x1 = text_x - text_size[0] // 2 - 5
-                            bg_y1 = text_y - text_size[1] - 5
-                            bg_x2 = text_x + text_size[0] // 2 + 5
-                            bg_y2 = text_y + 5
-                            cv2.rectangle(combined_frame, (bg_x1, bg_y1), (bg_x2, bg_y2), (0, 0, 0), -1)
-                            
-                            # テキストを描画
-                            text_x_adjusted = text_x - text_size[0] // 2
-                            cv2.putText(combined_frame, filename, (text_x_adjusted, text_y), 
-                                       font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
-                    
-                    out.write(combined_frame)
-                    output_frame_count += 1
-            else:
-                # 低速再生の処理
-                for frame_num in range(self.max_frames):
-                    # 進捗更新
-                    if output_frame_count % 10 == 0:
-                        progress = frame_num / self.max_frames
-                        self.root.after(0, lambda p=progress: self.update_progress(int(p * self.max_frames), self.max_frames))
-                    
-                    # 合成フレームを作成
-                    combined_frame = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
-                    
-                    for player in self.video_players:
-                        frame = player.get_frame(frame_num)
-                        if frame is not None:
-                            x, y = player.position
-                            w, h = player.size
-                            
-                            # フレームを配置
-                            combined_frame[y:y+h, x:x+w] = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                            
-                            # ファイル名を描画
-                            filename = os.path.basename(player.video_path)
-                            text_x = x + w // 2
-                            text_y = y + h - 10
-                            
-                            # テキストサイズを計算（動的にスケール調整）
-                            font = cv2.FONT_HERSHEY_SIMPLEX
-                            font_scale = min(w, h) / 400
-                            font_scale = max(0.3, min(1.0, font_scale))
-                            thickness = max(1, int(font_scale * 2))
-                            text_size = cv2.getTextSize(filename, font, font_scale, thickness)[0]
-                            
-                            # テキストの背景を描画（可読性向上）
-                            bg_x1 = text_x - text_size[0] // 2 - 5
-                            bg_y1 = text_y - text_size[1] - 5
-                            bg_x2 = text_x + text_size[0] // 2 + 5
-                            bg_y2 = text_y + 5
-                            cv2.rectangle(combined_frame, (bg_x1, bg_y1), (bg_x2, bg_y2), (0, 0, 0), -1)
-                            
-                            # テキストを描画
-                            text_x_adjusted = text_x - text_size[0] // 2
-                            cv2.putText(combined_frame, filename, (text_x_adjusted, text_y), 
-                                       font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
-                    
-                    # フレームを複数回書き込み（低速効果）
-                    for _ in range(frame_repeat):
-                        out.write(combined_frame)
-                        output_frame_count += 1
-            
-            # 保存完了
-            out.release()
+            # デコード→合成→書き込みのパイプラインで部分動画ごとに保存（並列数が2以上なら別プロセス）
+            # 保存には表示用とは別に元動画のデコーダを使い、プロキシやキャッシュは使わない
+            stats_list = render_comparison(tiles, canvas_size, frame_indices, output_path, fps,
+                                           export_workers, progress, encoder=encoder, cancel_event=cancel_event,
+                                           roi=roi, timelines=timelines, indexes=indexes)
+            for stats in stats_list:
+                print(format_export_stats(stats))
+            print(format_export_summary(output_path, stats_list))
             
             # 最終進捗更新
-            if speed_multiplier >= 1.0:
-                self.root.after(0, lambda: self.update_progress(total_output_frames, total_output_frames, "保存完了！"))
-            else:
-                self.root.after(0, lambda: self.update_progress(self.max_frames, self.max_frames, "保存完了！"))
-            
-            # 少し待ってから進捗ウィンドウを閉じる
-            self.root.after(1000, self.close_progress_window)
-            
-            # メインスレッドでメッセージを表示
-            speed_text = f" (速度: {speed_multiplier}x)" if speed_multiplier != 1.0 else ""
-            self.root.after(1500, lambda: self.show_completion_and_open(output_path, speed_text))
+            self._finish_save(output_path, speed_multiplier, len(frame_indices))
 
-        except Exception as e:
-            # エラーハンドリング
+        except ExportCancelled as e:
+            text = "保存をキャンセルしました"
+            if e.resumable:
+                text += "（同じ設定で保存すると続きから再開します）"
             self.root.after(0, self.close_progress_window)
-            self.root.after(100, lambda: messagebox.showerror("保存エラー", f"動画の保存中にエラーが発生しました:\n{str(e)}"))
-            print(f"保存エラー: {e}")
+            self.root.after(0, lambda: self.status_label.config(text=text))
+        except Exception as e:
+            self._fail_save(e)
+    
+    def _finish_save(self, output_path, speed_multiplier, total_frames):
+        self.root.after(0, lambda: self.update_progress(total_frames, total_frames, "保存完了！"))
+        
+        # 少し待ってから進捗ウィンドウを閉じる
+        self.root.after(1000, self.close_progress_window)
+        
+        # メインスレッドでメッセージを表示
+        speed_text = f" (速度: {speed_multiplier}x)" if speed_multiplier != 1.0 else ""
+        self.root.after(1500, lambda: self.show_completion_and_open(output_path, speed_text))
+    
+    def _fail_save(self, e):
+        # エラーハンドリング
+        self.root.after(0, self.close_progress_window)
+        self.root.after(100, lambda: messagebox.showerror("保存エラー", f"動画の保存中にエラーが発生しました:\n{str(e)}"))
+        print(f"保存エラー: {e}")
     
     def __del__(self):
         # クリーンアップ
-        for player in self.video_players:
+        for player in self.player_pool.values():
             player.release()
+        self.decode_pool.shutdown()
 
     def show_completion_and_open(self, output_path, speed_text):
         # 保存完了メッセージを表示
@@ -610,10 +3782,119 @@ class VideoComparisonApp:
         except Exception as e:
             messagebox.showerror("エラー", f"動画を開けませんでした:\n{str(e)}")
 
-def main():
-    root = TkinterDnD.Tk()
-    app = VideoComparisonApp(root)
-    root.mainloop()
+def parse_size(text):
+    # "1920x1080" を (幅, 高さ) にする
+    width, height = map(int, text.lower().split('x'))
+    return width, height
+
+def parse_offsets(text):
+    # "0,0.5,-1.25"（ジョブ定義ファイルではリストも可）を動画ごとの開始の遅れ（秒）にする（空ならNone）
+    if not text:
+        return None
+    values = text.split(',') if isinstance(text, str) else text
+    return [float(value) for value in values]
+
+def build_export_jobs(args):
+    # コマンドライン引数（とジョブ定義ファイル）から保存ジョブの一覧を作る
+    defaults = {'layout': args.layout, 'size': args.size, 'speed': args.speed,
+                'encoder': args.encoder, 'codec': args.codec, 'crf': args.crf, 'preset': args.preset,
+                'encoder_threads': args.encoder_threads, 'roi': args.roi, 'offsets': args.offsets}
+    if not args.manifest:
+        return [dict(defaults, inputs=args.inputs, output=args.output)]
+    
+    with open(args.manifest, encoding='utf-8') as f:
+        manifest = json.load(f)
+    entries = manifest['jobs'] if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    jobs = []
+    for entry in entries:
+        job = dict(defaults, **entry)
+        # 定義ファイルからの相対パスを解決
+        job['inputs'] = [os.path.join(base_dir, path) for path in job['inputs']]
+        job['output'] = os.path.join(base_dir, job['output'])
+        jobs.append(job)
+    return jobs
+
+def run_headless(args):
+    # Tkを使わずに比較動画を書き出す（ワーカープールは全ジョブで使い回す）
+    jobs = build_export_jobs(args)
+    executor = manager = None
+    if args.workers > 1:
+        executor, manager = create_export_pool(args.workers)
+    
+    failed = 0
+    try:
+        for number, job in enumerate(jobs, 1):
+            print(f"[{number}/{len(jobs)}] {job['output']}")
+            last_percent = [-1]
+            
+            def progress(done, total):
+                percent = done * 100 // total if total else 100
+                if percent // 10 != last_percent[0] // 10:
+                    last_percent[0] = percent
+                    print(f"  {percent}% ({done}/{total})", flush=True)
+            
+            encoder = {'backend': job['encoder'], 'codec': job['codec'], 'crf': job['crf'],
+                       'preset': job['preset'], 'threads': job['encoder_threads']}
+            try:
+                stats_list = export_comparison(job['inputs'], job['output'], job['layout'],
+                                               parse_size(job['size']), float(job['speed']),
+                                               args.workers, progress, executor, manager, encoder,
+                                               parse_roi(job['roi']), parse_offsets(job['offsets']))
+                for stats in stats_list:
+                    print("  " + format_export_stats(stats))
+                print("  " + format_export_summary(job['output'], stats_list))
+            except KeyboardInterrupt:
+                # 部分動画に分けて書き出すのはffmpegがある場合だけ
+                hint = "（同じ設定で再実行すると続きから保存します）" if find_ffmpeg() else ""
+                print(f"  中断しました{hint}", file=sys.stderr)
+                return 130
+            except Exception as e:
+                failed += 1
+                print(f"  保存エラー: {e}", file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            manager.shutdown()
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動画比較ビューア（-o または --manifest でGUIなしで保存）")
+    parser.add_argument('inputs', nargs='*', help="比較する動画ファイル")
+    parser.add_argument('-o', '--output', help="GUIなしで比較動画を書き出すファイル")
+    parser.add_argument('--manifest', help="複数の保存ジョブを定義したJSONファイル")
+    parser.add_argument('--layout', default="2x2", help="レイアウト（例: 2x2）")
+    parser.add_argument('--size', default="1920x1080", help="出力解像度（例: 1920x1080）")
+    parser.add_argument('--speed', type=float, default=1.0, help="再生速度")
+    parser.add_argument('--workers', type=int, default=1, help="保存の並列プロセス数")
+    parser.add_argument('--encoder', choices=["auto", "ffmpeg", "opencv"], default=DEFAULT_ENCODER_SETTINGS['backend'],
+                        help="エンコーダ（autoはffmpegがあればffmpeg）")
+    parser.add_argument('--codec', default=DEFAULT_ENCODER_SETTINGS['codec'], help="ffmpegのコーデック（例: libx264, libx265）")
+    parser.add_argument('--crf', type=int, default=DEFAULT_ENCODER_SETTINGS['crf'], help="ffmpegのCRF")
+    parser.add_argument('--preset', default=DEFAULT_ENCODER_SETTINGS['preset'], help="ffmpegのプリセット")
+    parser.add_argument('--encoder-threads', type=int, default=DEFAULT_ENCODER_SETTINGS['threads'],
+                        help="ffmpegのエンコードスレッド数（0は自動）")
+    parser.add_argument('--roi', help="保存する範囲（x,y,幅,高さ を元動画に対する0～1の比率で。例: 0.25,0.25,0.5,0.5）")
+    parser.add_argument('--offsets', help="動画ごとの開始の遅れ（秒、カンマ区切り。負なら先に進める。例: 0,0.5,-1.25）")
+    parser.add_argument('--trace', help="処理段階ごとの時間をChromeトレース形式（JSON）で書き出すファイル")
+    args = parser.parse_args(argv)
+    
+    if args.trace:
+        # 並列保存のワーカープロセス内の処理は記録されない
+        perf_tracer.start_trace()
+    try:
+        if args.output or args.manifest:
+            if not args.manifest and not args.inputs:
+                parser.error("入力動画を指定してください")
+            return run_headless(args)
+        
+        root = tkinterdnd2.TkinterDnD.Tk()
+        app = VideoComparisonApp(root)
+        root.mainloop()
+    finally:
+        if args.trace:
+            count = perf_tracer.dump_chrome_trace(args.trace)
+            print(f"トレースを保存しました: {args.trace} ({count}イベント)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file